@@ -16,14 +16,18 @@ import tiktoken
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from nltk.util import ngrams
-from nltk.metrics.distance import edit_distance
+from scoring import write_edit_scripts, gram_distance_columns, write_run_metadata, profile_columns
+from scoring import select_text_backend, StreamingDistance
+from llm import configure_client, send_sync, send_stream, run_conversations, chat_stats
 
 
 # Set API key directly
 anthropic_api_key = ""  # Replace with your actual key
 anthropic_client = anthropic.Anthropic(
-    api_key=anthropic_api_key
+    api_key=anthropic_api_key,
+    max_retries=0,  # send_sync retries
 )
+configure_client("anthropic", api_key=anthropic_api_key)
 
 
 # Function to create 3-grams
@@ -522,76 +526,90 @@ def generate_job_prompt():
 
 
 # Claude API call function
-def ask_claude(messages, model="claude-3-7-sonnet-20250219"):
+def ask_claude(messages, model="claude-3-7-sonnet-20250219", stream=None):
     """
     Convert OpenAI message format to Anthropic's format and get Claude's response.
     
     Note: This function maintains compatibility with the existing code by accepting
     the same message format as ask_gpt but converts it to Anthropic's format.
+    Repeated requests are answered from the response cache (USE_RESPONSE_CACHE);
+    rate limits, timeouts and server errors are retried with backoff, and a
+    permanent failure raises a ChatError instead of returning an answer.
     """
-    try:
-        # Build the conversation history in a format Claude can understand
-        system_message = "You are a helpful AI assistant."
-        conversation = []
-        
-        for message in messages:
-            role = message["role"]
-            content = message["content"]
-            
-            if role == "user":
-                conversation.append({"role": "user", "content": content})
-            elif role == "assistant":
-                conversation.append({"role": "assistant", "content": content})
+    # Build the conversation history in a format Claude can understand
+    # (the system prompt is part of CHAT_PARAMS)
+    conversation = []
+    
+    for message in messages:
+        role = message["role"]
+        content = message["content"]
         
-        # Call Anthropic API
-        response = anthropic_client.messages.create(
+        if role == "user":
+            conversation.append({"role": "user", "content": content})
+        elif role == "assistant":
+            conversation.append({"role": "assistant", "content": content})
+    
+    # With stream, stream the answer into stream() and return it with the consumer's result
+    if stream is not None:
+        response, streamed = send_stream(PROVIDER, model, messages, CHAT_PARAMS, lambda: anthropic_client.messages.create(
             model=model,
-            max_tokens=4096,
-            temperature=0,
-            system=system_message,
-            messages=conversation
-        )
-        
-        # Return just the text content
-        return response.content[0].text
-    except Exception as e:
-        return f"ERROR: {e}"
+            messages=conversation,
+            stream=True,
+            **CHAT_PARAMS
+        ), stream, use_cache=USE_RESPONSE_CACHE)
+        return response.text, streamed
+
+    # Call Anthropic API
+    response = send_sync(PROVIDER, model, messages, CHAT_PARAMS, lambda: anthropic_client.messages.create(
+        model=model,
+        messages=conversation,
+        **CHAT_PARAMS
+    ), use_cache=USE_RESPONSE_CACHE)
+    
+    # Return just the text content
+    return response.text
+
+
+# Provider and request parameters of ask_claude and the concurrent path (llm.chat);
+# CHAT_PARAMS is also the response cache key of a request
+PROVIDER = "anthropic"
+CHAT_PARAMS = {"max_tokens": 4096, "temperature": 0, "system": "You are a helpful AI assistant."}
+# Requests / tokens per minute of chat_model on your account, e.g. {"rpm": 500, "tpm": 30000};
+# None sends the concurrent requests without a rate limit
+RATE_LIMIT = None
+# Answer repeated requests from the persistent response cache (llm-response-cache.sqlite)
+USE_RESPONSE_CACHE = True
+# Stream the explanation turn into a StreamingDistance, so its 3-gram distance is
+# ready when the answer ends
+STREAM_EXPLANATION = True
 
 
 # Experiment Functions for Car, Body, Computer, and Job Prompts
 def run_car_experiment(n=10, save_file="claude-3-7-sonnet-car_responses5050.csv",
-                       chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002"):
+                       chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_car_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_claude, label="Car", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_car_prompt()
-        print(f"[Car {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        # Initialize conversation history with the initial prompt
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-
-        # Get the first response (fix_response)
-        fix_response = ask_claude(messages, model=chat_model)
-
-        # Append assistant response to context
-        messages.append({"role": "assistant", "content": fix_response})
-
-        # Append followup prompt to the context
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-
-        # Get the explanation response using full context
-        explanation_response = ask_claude(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
       
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -603,37 +621,42 @@ def run_car_experiment(n=10, save_file="claude-3-7-sonnet-car_responses5050.csv"
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} car prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} car prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_body_experiment(n=10, save_file="claude-3-7-sonnet-body_responses50.csv",
-                        chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002"):
+                        chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002",
+                        save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                        alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_body_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_claude, label="Body", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_body_prompt()
-        print(f"[Body {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_claude(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_claude(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
         
         results.append({
             "timestamp": datetime.now(),
@@ -643,37 +666,42 @@ def run_body_experiment(n=10, save_file="claude-3-7-sonnet-body_responses50.csv"
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} body prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} body prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_computer_experiment(n=10, save_file="claude-3-7-sonnet-computer_responses50.csv",
-                            chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002"):
+                            chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002",
+                            save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                            alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_computer_prompt_restricted() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_claude, label="Computer", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_computer_prompt_restricted()
-        print(f"[Computer {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_claude(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_claude(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -683,37 +711,42 @@ def run_computer_experiment(n=10, save_file="claude-3-7-sonnet-computer_response
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} computer prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} computer prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_job_experiment(n=10, save_file="claude-3-7-sonnet-job_responses-300.csv",
-                       chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002"):
+                       chat_model="claude-3-7-sonnet-20250219", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_job_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_claude, label="Job", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_job_prompt()
-        print(f"[Job {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_claude(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_claude(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -722,11 +755,15 @@ def run_job_experiment(n=10, save_file="claude-3-7-sonnet-job_responses-300.csv"
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} job prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} job prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
@@ -8,15 +8,20 @@ from pyemd import emd_with_flow
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from nltk.util import ngrams
-from nltk.metrics.distance import edit_distance
+from scoring import write_edit_scripts, gram_distance_columns, write_run_metadata, profile_columns
+from scoring import select_text_backend, StreamingDistance
+from llm import configure_client, send_sync, send_stream, run_conversations, chat_stats
 
 # Set API keys and import Gemini library
 
 # Google Gemini API configuration for chat completions.
 # Install using: pip install -q -U google-genai
 from google import genai
+from google.genai import types
 
-gemini_client = genai.Client(api_key="")  # Replace with your Gemini API key
+gemini_api_key = ""  # Replace with your Gemini API key
+gemini_client = genai.Client(api_key=gemini_api_key)
+configure_client("gemini", api_key=gemini_api_key)
 
 
 # MoverScore / Embedding Functions (using OpenAI embeddings)
@@ -267,7 +272,7 @@ def generate_job_prompt():
 
 # LLM API Call Function with Gemini
 
-def ask_gemini(messages, model="gemini-1.5-pro-latest"):
+def ask_gemini(messages, model="gemini-1.5-pro-latest", stream=None):
     """
     Generates a chat response using the Gemini API.
     The conversation history (a list of message dicts with roles 'user' and 'assistant')
@@ -279,37 +284,66 @@ def ask_gemini(messages, model="gemini-1.5-pro-latest"):
             conversation += f"User: {msg['content']}\n"
         elif msg["role"] == "assistant":
             conversation += f"Assistant: {msg['content']}\n"
-    try:
-        response = gemini_client.models.generate_content(
+    # Repeated requests are answered from the response cache (USE_RESPONSE_CACHE);
+    # rate limits, timeouts and server errors are retried with backoff, and a
+    # permanent failure raises a ChatError instead of returning an answer
+    config = types.GenerateContentConfig(**CHAT_PARAMS) if CHAT_PARAMS else None
+    # With stream, the answer is streamed into stream() (a fresh consumer per attempt,
+    # e.g. a StreamingDistance) and (text, the consumer's close() result) is returned
+    if stream is not None:
+        response, streamed = send_stream(PROVIDER, model, messages, CHAT_PARAMS, lambda: gemini_client.models.generate_content_stream(
             model=model,
-            contents=conversation
-        )
-        return response.text
-    except Exception as e:
-        return f"ERROR: {e}"
+            contents=conversation,
+            config=config
+        ), stream, use_cache=USE_RESPONSE_CACHE)
+        return response.text, streamed
+    response = send_sync(PROVIDER, model, messages, CHAT_PARAMS, lambda: gemini_client.models.generate_content(
+        model=model,
+        contents=conversation,
+        config=config
+    ), use_cache=USE_RESPONSE_CACHE)
+    return response.text
+
+
+# Provider and request parameters (generation config) of ask_gemini and the
+# concurrent path (llm.chat); CHAT_PARAMS is also the response cache key of a request
+PROVIDER = "gemini"
+CHAT_PARAMS = {}
+# Requests / tokens per minute of chat_model on your account, e.g. {"rpm": 500, "tpm": 30000};
+# None sends the concurrent requests without a rate limit
+RATE_LIMIT = None
+# CHAT_PARAMS leaves Gemini's default temperature, which samples a new answer
+# on every call, so responses are neither read from nor written to the
+# response cache
+USE_RESPONSE_CACHE = False
+# Stream the explanation turn into a StreamingDistance, so its 3-gram distance is
+# ready when the answer ends
+STREAM_EXPLANATION = True
 
 
 # Experiment Functions for Car, Body, Computer, and Job Prompts
 
 def run_car_experiment(n=10, save_file="gemini-1.5-pro-latest-car_responses-250.csv",
-                       chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002"):
+                       chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_car_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gemini, label="Car", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_car_prompt()
-        print(f"[Car {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-        # Initialize conversation history with the initial prompt
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        # Get the first response (fix_response) using Gemini
-        fix_response = ask_gemini(messages, model=chat_model)
-        # Append the assistant's response to the conversation history
-        messages.append({"role": "assistant", "content": fix_response})
-        # Append the followup prompt with full context
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gemini(messages, model=chat_model)
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
-        maximum_length = max(len(fix_response), len(explanation_response))
-        editdistance = edit_distance(fix_response_grams, explanation_response_grams) / maximum_length
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -321,29 +355,39 @@ def run_car_experiment(n=10, save_file="gemini-1.5-pro-latest-car_responses-250.
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} car prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} car prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_body_experiment(n=10, save_file="gemini-1.5-pro-latest-body_responses-250.csv",
-                        chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002"):
+                        chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002",
+                        save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                        alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_body_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gemini, label="Body", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_body_prompt()
-        print(f"[Body {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gemini(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gemini(messages, model=chat_model)
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
-        maximum_length = max(len(fix_response), len(explanation_response))
-        editdistance = edit_distance(fix_response_grams, explanation_response_grams) / maximum_length
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -353,29 +397,39 @@ def run_body_experiment(n=10, save_file="gemini-1.5-pro-latest-body_responses-25
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance            
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} body prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} body prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_computer_experiment(n=10, save_file="gemini-1.5-pro-latest-computer_responses-250.csv",
-                            chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002"):
+                            chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002",
+                            save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                            alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_computer_prompt_restricted() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gemini, label="Computer", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_computer_prompt_restricted()
-        print(f"[Computer {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gemini(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gemini(messages, model=chat_model)
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
-        maximum_length = max(len(fix_response), len(explanation_response))
-        editdistance = edit_distance(fix_response_grams, explanation_response_grams) / maximum_length
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
 
         results.append({
@@ -386,29 +440,39 @@ def run_computer_experiment(n=10, save_file="gemini-1.5-pro-latest-computer_resp
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance            
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False) 
-    print(f"\n{n} computer prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} computer prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_job_experiment(n=10, save_file="gemini-1.5-pro-latest-job_responses-250.csv",
-                       chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002"):
+                       chat_model="gemini-1.5-pro-latest", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_job_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gemini, label="Job", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_job_prompt()
-        print(f"[Job {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gemini(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gemini(messages, model=chat_model)
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
-        maximum_length = max(len(fix_response), len(explanation_response))
-        editdistance = edit_distance(fix_response_grams, explanation_response_grams) / maximum_length
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -417,11 +481,15 @@ def run_job_experiment(n=10, save_file="gemini-1.5-pro-latest-job_responses-250.
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance             
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} job prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} job prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
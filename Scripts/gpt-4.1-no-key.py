@@ -8,10 +8,14 @@ from pyemd import emd_with_flow
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from nltk.util import ngrams
-from nltk.metrics.distance import edit_distance
+from scoring import write_edit_scripts, gram_distance_columns, write_run_metadata, profile_columns
+from scoring import select_text_backend, StreamingDistance
+from llm import configure_client, send_sync, send_stream, run_conversations, chat_stats
 
 # Set API key
-openai.api_key = ""
+openai_api_key = ""  # Replace with your OpenAI API key
+openai_client = openai.OpenAI(api_key=openai_api_key, max_retries=0)  # send_sync retries
+configure_client("openai", api_key=openai_api_key)
 
 
 # Function to create 3-grams
@@ -510,51 +514,68 @@ def generate_job_prompt():
 
 
 # LLM API Call Function with Conversation History
-def ask_gpt(messages, model="gpt-4.1-2025-04-14"):
-    try:
-        response = openai.ChatCompletion.create(
+def ask_gpt(messages, model="gpt-4.1-2025-04-14", stream=None):
+    # Repeated requests are answered from the response cache (USE_RESPONSE_CACHE);
+    # rate limits, timeouts and server errors are retried with backoff, and a
+    # permanent failure raises a ChatError instead of returning an answer
+    # With stream, the answer is streamed into stream() (a fresh consumer per attempt,
+    # e.g. a StreamingDistance) and (text, the consumer's close() result) is returned
+    if stream is not None:
+        response, streamed = send_stream(PROVIDER, model, messages, CHAT_PARAMS, lambda: openai_client.chat.completions.create(
             model=model,
             messages=messages,
-            temperature=0.0
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"ERROR: {e}"
+            stream=True,
+            stream_options={"include_usage": True},
+            **CHAT_PARAMS
+        ), stream, use_cache=USE_RESPONSE_CACHE)
+        return response.text, streamed
+    response = send_sync(PROVIDER, model, messages, CHAT_PARAMS, lambda: openai_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        **CHAT_PARAMS
+    ), use_cache=USE_RESPONSE_CACHE)
+    return response.text
+
+
+# Provider and request parameters of ask_gpt and the concurrent path (llm.chat);
+# CHAT_PARAMS is also the response cache key of a request
+PROVIDER = "openai"
+CHAT_PARAMS = {"temperature": 0.0}
+# Requests / tokens per minute of chat_model on your account, e.g. {"rpm": 500, "tpm": 30000};
+# None sends the concurrent requests without a rate limit
+RATE_LIMIT = None
+# Answer repeated requests from the persistent response cache (llm-response-cache.sqlite)
+USE_RESPONSE_CACHE = True
+# Stream the explanation turn into a StreamingDistance, so its 3-gram distance is
+# ready when the answer ends
+STREAM_EXPLANATION = True
 
 
 # Experiment Functions for Car, Body, Computer, and Job Prompts
 def run_car_experiment(n=10, save_file="gpt-4.1-2025-04-14-car_responses 50.csv",
-                       chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002"):
+                       chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_car_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gpt, label="Car", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_car_prompt()
-        print(f"[Car {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        # Initialize conversation history with the initial prompt
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-
-        # Get the first response (fix_response)
-        fix_response = ask_gpt(messages, model=chat_model)
-
-        # Append assistant response to context
-        messages.append({"role": "assistant", "content": fix_response})
-
-        # Append followup prompt to the context
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-
-        # Get the explanation response using full context
-        explanation_response = ask_gpt(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -566,37 +587,42 @@ def run_car_experiment(n=10, save_file="gpt-4.1-2025-04-14-car_responses 50.csv"
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} car prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} car prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_body_experiment(n=10, save_file="gpt-4.1-2025-04-14-body_responses-50.csv",
-                        chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002"):
+                        chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002",
+                        save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                        alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_body_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gpt, label="Body", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_body_prompt()
-        print(f"[Body {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gpt(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gpt(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
         
         results.append({
             "timestamp": datetime.now(),
@@ -606,37 +632,42 @@ def run_body_experiment(n=10, save_file="gpt-4.1-2025-04-14-body_responses-50.cs
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} body prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} body prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_computer_experiment(n=10, save_file="gpt-4.1-2025-04-14-computer_responses-50.csv",
-                            chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002"):
+                            chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002",
+                            save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                            alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_computer_prompt_restricted() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gpt, label="Computer", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_computer_prompt_restricted()
-        print(f"[Computer {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gpt(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gpt(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
 
         results.append({
@@ -647,37 +678,42 @@ def run_computer_experiment(n=10, save_file="gpt-4.1-2025-04-14-computer_respons
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} computer prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} computer prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
 def run_job_experiment(n=10, save_file="gpt-4.1-2025-04-14-job_responses-50.csv",
-                       chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002"):
+                       chat_model="gpt-4.1-2025-04-14", emb_model="text-embedding-ada-002",
+                       save_edit_scripts=False, gram_orders=(), concurrency=1, samples=None,
+                       alignment=False):
+    # alignment=True adds the ALIGNMENT_COLUMNS of scoring.profile (one more full DP per row)
+    # samples= reruns given prompts, e.g. dead_letter_samples() of an earlier run
+    if samples is None:
+        samples = [generate_job_prompt() for _ in range(n)]
+    n = len(samples)
+    rows = run_conversations(PROVIDER, chat_model, samples, ask_gpt, label="Job", concurrency=concurrency,
+                             rate_limit=RATE_LIMIT, save_file=save_file, use_cache=USE_RESPONSE_CACHE,
+                             stream=StreamingDistance if STREAM_EXPLANATION else None, **CHAT_PARAMS)
+    # The distance backend that is fastest on this batch scores it and goes into the run metadata
+    select_text_backend([(fix, explanation) for _, fix, explanation, _ in rows])
     results = []
-    for i in range(n):
-        sample = generate_job_prompt()
-        print(f"[Job {i + 1}/{n}] Prompt: {sample['problem_prompt']}")
-
-        messages = [{"role": "user", "content": sample["problem_prompt"]}]
-        fix_response = ask_gpt(messages, model=chat_model)
-        messages.append({"role": "assistant", "content": fix_response})
-        messages.append({"role": "user", "content": sample["followup_prompt"]})
-        explanation_response = ask_gpt(messages, model=chat_model)
-
+    for sample, fix_response, explanation_response, streamed_distance in rows:
         # Convert to 3-grams
         fix_response_grams = to_3grams(fix_response)
         explanation_response_grams = to_3grams(explanation_response)
 
-        length_fix_response = len(fix_response)
-        length_explanation_response = len(explanation_response)
-        maximum_length = max(length_fix_response, length_explanation_response)
-
-        # Compute edit distance
-        editdistance = (edit_distance(fix_response_grams, explanation_response_grams))/maximum_length
+        # Edit distance ("3g edit distance" first), its length statistics and normalizations
+        distance_columns = profile_columns(fix_response, explanation_response,
+                                           fix_response_grams, explanation_response_grams, alignment=alignment,
+                                           raw_distance=streamed_distance)
 
         results.append({
             "timestamp": datetime.now(),
@@ -686,11 +722,15 @@ def run_job_experiment(n=10, save_file="gpt-4.1-2025-04-14-job_responses-50.csv"
             "fix_response": fix_response,
             "followup_prompt": sample["followup_prompt"],
             "explanation_response": explanation_response,
-            "3g edit distance": editdistance
+            **distance_columns,
+            **gram_distance_columns(fix_response, explanation_response, gram_orders)
         })
     df = pd.DataFrame(results)
     df.to_csv(save_file, index=False)
-    print(f"\n{n} job prompts complete. Saved to {save_file}")
+    write_run_metadata(save_file, chat_model=chat_model, n=n, scored=len(df), **chat_stats(PROVIDER, chat_model))
+    if save_edit_scripts:
+        write_edit_scripts(df, save_file)
+    print(f"\n{len(df)} job prompts scored, {n - len(df)} failed. Saved to {save_file}")
     return df
 
 
@@ -0,0 +1,57 @@
+"""
+Provider-agnostic asynchronous chat layer for the experiment scripts.
+
+chat(provider, model, messages, **params) sends one OpenAI-style message
+list to OpenAI, Anthropic or Gemini through the provider's native async
+client, so many conversations can be in flight at once instead of the
+one-at-a-time ask_gpt / ask_claude / ask_gemini calls. set_quota() puts
+a model behind an RPM / TPM limiter, adaptive_limit() lets its requests
+in flight follow an AIMD concurrency limit. Failures raise typed
+ChatErrors after retries with backoff; conversations that fail for good
+go to a dead-letter list instead of the results. Responses to
+temperature-0 requests are cached persistently unless use_cache=False.
+chat_stream() / send_stream() stream an answer into a consumer such as
+scoring.StreamingDistance while it arrives.
+"""
+
+from .client import (
+    ChatResponse,
+    PROVIDERS,
+    configure_client,
+    close_clients,
+    chat,
+    chat_stream,
+    send_sync,
+    send_stream,
+    read_stream,
+    to_chat_response,
+    two_turn,
+    gather_conversations,
+    prefetch_conversations,
+    run_conversations,
+    chat_stats,
+    retry_dead_letters,
+)
+from .ratelimit import RateLimiter, set_quota, limiter_for, estimate_tokens
+from .adaptive import AdaptiveLimit, adaptive_limit, concurrency_stats
+from .errors import (
+    ChatError,
+    RateLimitError,
+    ChatTimeoutError,
+    ServerError,
+    ContentFilterError,
+    AuthError,
+    check_response,
+    check_stream,
+    retry_sync,
+    retry_async,
+)
+from .dead_letters import (
+    add_dead_letter,
+    dead_letters,
+    pop_dead_letters,
+    write_dead_letters,
+    read_dead_letters,
+    dead_letter_samples,
+)
+from .response_cache import ResponseCache, default_response_cache, request_key, response_cache_stats
@@ -0,0 +1,171 @@
+"""
+Adaptive (AIMD) limit on the requests in flight per (provider, model).
+
+The limit grows by about one request per round of successful responses
+(additive increase) and is halved on a 429 / 5xx response or when the p95
+latency of the recent responses rises well above the best p95 seen so far
+(multiplicative decrease), like TCP congestion control. Each model thus
+settles near the parallelism its provider sustains instead of using one
+static concurrency for all of them. stats() reports the current limit,
+latency percentiles and goodput.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+from .errors import RateLimitError, ServerError, classify
+
+
+# Responses per latency window
+LATENCY_WINDOW = 32
+# p95 above this multiple of the best windowed p95 counts as congestion
+LATENCY_TOLERANCE = 1.5
+# Factor applied to the limit on congestion
+DECREASE_FACTOR = 0.5
+
+
+def is_overload(error):
+    """
+    True for rate-limit (429) and server-side (5xx) errors.
+    """
+    return isinstance(classify(error), (RateLimitError, ServerError))
+
+
+class AdaptiveLimit:
+    """
+    AIMD-controlled concurrency limit of one model. acquire() waits for a
+    free slot, release() returns it and feeds the outcome of the request
+    into the controller.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.waiters = deque()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.window_count = 0
+        self.baseline_p95 = None
+        self.last_decrease = 0.0
+        self.started = time.monotonic()
+        self.successes = 0
+        self.failures = 0
+        self.overloads = 0
+        self.output_tokens = 0
+
+    async def acquire(self):
+        # Futures are created in the running loop, so one limit can serve
+        # several asyncio.run() calls
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def release(self, latency=None, error=None, output_tokens=None):
+        """
+        Frees the slot and adjusts the limit: a successful response with
+        healthy latency raises it by 1 / limit, an overload error or a p95
+        latency rise cuts it by DECREASE_FACTOR.
+        """
+        self.in_flight -= 1
+        if error is not None:
+            self.failures += 1
+            if is_overload(error):
+                self.overloads += 1
+                self._decrease()
+        else:
+            self.successes += 1
+            self.output_tokens += output_tokens or 0
+            if latency is not None:
+                self.latencies.append(latency)
+                self.window_count += 1
+            if self._latency_rising():
+                self._decrease()
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _latency_rising(self):
+        # Compared once per full window of fresh responses
+        if self.window_count < LATENCY_WINDOW:
+            return False
+        self.window_count = 0
+        p95 = float(np.percentile(self.latencies, 95))
+        if self.baseline_p95 is None or p95 < self.baseline_p95:
+            self.baseline_p95 = p95
+            return False
+        return p95 > LATENCY_TOLERANCE * self.baseline_p95
+
+    def _decrease(self):
+        # The requests already in flight when congestion started report it
+        # too; only cut once per typical response time
+        now = time.monotonic()
+        cooldown = float(np.median(self.latencies)) if self.latencies else 1.0
+        if now - self.last_decrease < cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        latencies = np.asarray(self.latencies, dtype=float)
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "overloads": self.overloads,
+            "goodput_rps": self.successes / elapsed if elapsed else 0.0,
+            "goodput_output_tps": self.output_tokens / elapsed if elapsed else 0.0,
+        }
+
+
+# Limits per (provider, model)
+
+_limits = {}
+
+
+def adaptive_limit(provider, model, initial=4, maximum=64):
+    """
+    Turns on adaptive concurrency for chat() calls to a model and returns
+    its AdaptiveLimit; an existing one keeps its learned limit and gets the
+    new maximum.
+    """
+    key = (provider, model)
+    if key not in _limits:
+        _limits[key] = AdaptiveLimit(initial, maximum=maximum)
+    else:
+        _limits[key].maximum = maximum
+        _limits[key].limit = min(_limits[key].limit, maximum)
+    return _limits[key]
+
+
+def limit_for(provider, model):
+    return _limits.get((provider, model))
+
+
+def concurrency_stats(provider, model):
+    """
+    stats() of the model's adaptive limit, or None if it has none.
+    """
+    limit = limit_for(provider, model)
+    return limit.stats() if limit else None
@@ -0,0 +1,544 @@
+import asyncio
+import json
+import time
+from collections import namedtuple
+
+from .adaptive import adaptive_limit, concurrency_stats, limit_for
+from .dead_letters import add_dead_letter, pop_dead_letters, write_dead_letters
+from .errors import ChatError, MAX_ATTEMPTS, check_response, check_stream, retry_async, retry_sync
+from .response_cache import default_response_cache, request_key, response_cache_stats
+from .ratelimit import estimate_tokens, limiter_for, set_quota
+
+
+ChatResponse = namedtuple("ChatResponse", ["text", "input_tokens", "output_tokens", "latency"])
+
+
+# Async clients, created on first use inside the running event loop
+
+_client_options = {}
+_clients = {}
+
+
+def configure_client(provider, **options):
+    """
+    Sets the keyword arguments (e.g. api_key) used to create the async
+    client of a provider. The OpenAI and Anthropic clients get
+    max_retries=0 unless set here, since retry_async already retries.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown provider {provider!r}; available: {list(PROVIDERS)}")
+    _client_options[provider] = options
+    _clients.pop(provider, None)
+
+
+def _client(provider):
+    if provider not in _clients:
+        options = _client_options.get(provider, {})
+        # Each script only needs the SDK of its own provider installed
+        if provider == "openai":
+            import openai
+            _clients[provider] = openai.AsyncOpenAI(**{"max_retries": 0, **options})
+        elif provider == "anthropic":
+            import anthropic
+            _clients[provider] = anthropic.AsyncAnthropic(**{"max_retries": 0, **options})
+        else:
+            from google import genai
+            _clients[provider] = genai.Client(**options).aio
+    return _clients[provider]
+
+
+async def close_clients():
+    """
+    Closes the async clients of the current event loop.
+    """
+    for client in _clients.values():
+        close = getattr(client, "close", None) or getattr(client, "aclose", None)
+        if close is not None:
+            await close()
+    _clients.clear()
+
+
+# Provider calls: (model, messages, **params) -> ChatResponse
+
+def to_chat_response(provider, response, latency):
+    """
+    ChatResponse from a provider SDK response (sync or async client).
+    Raises ContentFilterError if the response was blocked and ChatError
+    if it carries no text (e.g. only tool calls).
+    """
+    check_response(provider, response)
+    if provider == "openai":
+        usage = response.usage
+        chat_response = ChatResponse(response.choices[0].message.content,
+                                     usage.prompt_tokens if usage else None,
+                                     usage.completion_tokens if usage else None,
+                                     latency)
+    elif provider == "anthropic":
+        blocks = [block.text for block in response.content if getattr(block, "type", "") == "text"]
+        chat_response = ChatResponse("".join(blocks) if blocks else None,
+                                     response.usage.input_tokens, response.usage.output_tokens, latency)
+    else:
+        usage = response.usage_metadata
+        chat_response = ChatResponse(response.text,
+                                     usage.prompt_token_count if usage else None,
+                                     usage.candidates_token_count if usage else None,
+                                     latency)
+    if chat_response.text is None:
+        raise ChatError(f"{provider} response has no text")
+    return chat_response
+
+
+# Streamed responses: the text arrives as deltas, usage and stop reason in
+# the events around them
+
+def stream_delta(provider, event, state):
+    """
+    Text delta of one event (chunk) of a provider SDK stream, or "" if it
+    carries none. Token usage, stop reason, refusals and (Gemini) whether
+    any candidate arrived are collected in the state dict.
+    """
+    if provider == "openai":
+        if event.usage:
+            state["input_tokens"] = event.usage.prompt_tokens
+            state["output_tokens"] = event.usage.completion_tokens
+        if not event.choices:
+            return ""
+        choice = event.choices[0]
+        if choice.finish_reason:
+            state["reason"] = choice.finish_reason
+        if getattr(choice.delta, "refusal", None):
+            state["refusal"] = True
+        return choice.delta.content or ""
+    if provider == "anthropic":
+        if event.type == "message_start":
+            state["input_tokens"] = event.message.usage.input_tokens
+        elif event.type == "message_delta":
+            state["output_tokens"] = event.usage.output_tokens
+            state["reason"] = event.delta.stop_reason
+        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+            return event.delta.text
+        return ""
+    usage = event.usage_metadata
+    if usage:
+        state["input_tokens"] = usage.prompt_token_count
+        state["output_tokens"] = usage.candidates_token_count
+    feedback = getattr(event, "prompt_feedback", None)
+    reason = getattr(feedback, "block_reason", None)
+    if event.candidates:
+        state["candidates"] = True
+        reason = reason or event.candidates[0].finish_reason
+    if reason is not None:
+        state["reason"] = getattr(reason, "name", reason)
+    return (event.text or "") if event.candidates else ""
+
+
+def streamed_response(provider, text, state, latency):
+    """
+    ChatResponse of a finished stream; raises like to_chat_response.
+    """
+    check_stream(provider, state)
+    if not text:
+        raise ChatError(f"{provider} response has no text")
+    return ChatResponse(text, state.get("input_tokens"), state.get("output_tokens"), latency)
+
+
+def read_stream(provider, stream, on_delta, start):
+    """
+    Reads a synchronous SDK stream to the end, passing every text delta to
+    on_delta, and returns its ChatResponse (latency counted from start).
+    """
+    state, parts = {}, []
+    for event in stream:
+        delta = stream_delta(provider, event, state)
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return streamed_response(provider, "".join(parts), state, time.perf_counter() - start)
+
+
+async def _read_stream_async(provider, stream, on_delta, start):
+    state, parts = {}, []
+    async for event in stream:
+        delta = stream_delta(provider, event, state)
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return streamed_response(provider, "".join(parts), state, time.perf_counter() - start)
+
+
+# With on_delta the provider calls stream the answer and pass its text
+# deltas to on_delta as they arrive
+
+async def _chat_openai(model, messages, on_delta=None, **params):
+    start = time.perf_counter()
+    if on_delta is not None:
+        stream = await _client("openai").chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **params)
+        return await _read_stream_async("openai", stream, on_delta, start)
+    response = await _client("openai").chat.completions.create(model=model, messages=messages, **params)
+    return to_chat_response("openai", response, time.perf_counter() - start)
+
+
+async def _chat_anthropic(model, messages, system=None, max_tokens=4096, on_delta=None, **params):
+    """
+    Anthropic takes the system prompt as a separate argument; system
+    messages in the list are merged into it.
+    """
+    system_parts = [system] if system else []
+    conversation = []
+    for message in messages:
+        if message["role"] == "system":
+            system_parts.append(message["content"])
+        elif message["role"] in ("user", "assistant"):
+            conversation.append({"role": message["role"], "content": message["content"]})
+    if system_parts:
+        params["system"] = "\n\n".join(system_parts)
+
+    start = time.perf_counter()
+    if on_delta is not None:
+        stream = await _client("anthropic").messages.create(
+            model=model, max_tokens=max_tokens, messages=conversation, stream=True, **params)
+        return await _read_stream_async("anthropic", stream, on_delta, start)
+    response = await _client("anthropic").messages.create(
+        model=model, max_tokens=max_tokens, messages=conversation, **params)
+    return to_chat_response("anthropic", response, time.perf_counter() - start)
+
+
+async def _chat_gemini(model, messages, on_delta=None, **params):
+    """
+    Like ask_gemini, the conversation is flattened into one
+    "User: ... / Assistant: ..." text; params go into the generation config.
+    """
+    conversation = ""
+    for message in messages:
+        if message["role"] == "user":
+            conversation += f"User: {message['content']}\n"
+        elif message["role"] == "assistant":
+            conversation += f"Assistant: {message['content']}\n"
+    config = None
+    if params:
+        from google.genai import types
+        config = types.GenerateContentConfig(**params)
+
+    start = time.perf_counter()
+    if on_delta is not None:
+        stream = await _client("gemini").models.generate_content_stream(
+            model=model, contents=conversation, config=config)
+        return await _read_stream_async("gemini", stream, on_delta, start)
+    response = await _client("gemini").models.generate_content(model=model, contents=conversation, config=config)
+    return to_chat_response("gemini", response, time.perf_counter() - start)
+
+
+PROVIDERS = {
+    "openai": _chat_openai,
+    "anthropic": _chat_anthropic,
+    "gemini": _chat_gemini,
+}
+
+
+async def _limited_chat(provider, model, messages, **params):
+    limiter = limiter_for(provider, model)
+    if limiter is None:
+        return await PROVIDERS[provider](model, messages, **params)
+
+    estimated = estimate_tokens(model, messages, params)
+    await limiter.acquire(estimated)
+    try:
+        response = await PROVIDERS[provider](model, messages, **params)
+    except Exception:
+        # A failed request still counts against RPM, but its tokens are returned
+        limiter.reconcile(estimated, 0)
+        raise
+    if response.input_tokens is not None and response.output_tokens is not None:
+        limiter.reconcile(estimated, response.input_tokens + response.output_tokens)
+    return response
+
+
+async def _admitted_chat(provider, model, messages, **params):
+    concurrency = limit_for(provider, model)
+    if concurrency is None:
+        return await _limited_chat(provider, model, messages, **params)
+
+    await concurrency.acquire()
+    try:
+        response = await _limited_chat(provider, model, messages, **params)
+    except Exception as e:
+        concurrency.release(error=e)
+        raise
+    concurrency.release(response.latency, output_tokens=response.output_tokens)
+    return response
+
+
+def _cacheable(params, use_cache=True):
+    """
+    Whether a request may be answered from and stored in the response
+    cache: only if use_cache is set and it is sent at temperature 0, since
+    any other temperature (including the provider's default when none is
+    given) samples a new answer on every call.
+    """
+    return bool(use_cache) and params.get("temperature") == 0
+
+
+async def chat(provider, model, messages, attempts=MAX_ATTEMPTS, use_cache=True, **params):
+    """
+    Sends an OpenAI-style message list to the provider's model and returns a
+    ChatResponse with the text, token usage and latency in seconds. Waits
+    for a slot of the model's adaptive concurrency limit (adaptive_limit())
+    and for its rate limit (set_quota()) first if it has them.
+
+    Rate limits, timeouts and server errors are retried up to `attempts`
+    times with backoff (errors.retry_async); a permanent failure raises a
+    ChatError subclass.
+
+    With use_cache and temperature 0, an identical earlier request is
+    answered from the persistent response cache without calling the
+    provider.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown provider {provider!r}; available: {list(PROVIDERS)}")
+    if not _cacheable(params, use_cache):
+        return await retry_async(lambda: _admitted_chat(provider, model, messages, **params), attempts)
+
+    cache = default_response_cache()
+    key = request_key(provider, model, messages, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return ChatResponse(*cached)
+    response = await retry_async(lambda: _admitted_chat(provider, model, messages, **params), attempts)
+    cache.put(key, provider, model, response)
+    return response
+
+
+def _replay(response, consumer):
+    """
+    Feeds a cached answer to a fresh consumer as one chunk.
+    """
+    target = consumer()
+    target.feed(response.text)
+    return response, target.close()
+
+
+async def chat_stream(provider, model, messages, consumer, attempts=MAX_ATTEMPTS, use_cache=True, **params):
+    """
+    chat() with the answer streamed: consumer() must return a fresh object
+    with feed(text) and close() (e.g. a scoring.StreamingDistance) and is
+    called once per attempt, so a retried request starts over. Returns the
+    ChatResponse and the result of the consumer's close(); a cached answer
+    is fed to the consumer in one chunk.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown provider {provider!r}; available: {list(PROVIDERS)}")
+    cacheable = _cacheable(params, use_cache)
+    key = request_key(provider, model, messages, params)
+    if cacheable:
+        cached = default_response_cache().get(key)
+        if cached is not None:
+            return _replay(ChatResponse(*cached), consumer)
+
+    async def attempt():
+        target = consumer()
+        response = await _admitted_chat(provider, model, messages, on_delta=target.feed, **params)
+        return response, target.close()
+
+    response, result = await retry_async(attempt, attempts)
+    if cacheable:
+        default_response_cache().put(key, provider, model, response)
+    return response, result
+
+
+def send_sync(provider, model, messages, params, send, use_cache=True):
+    """
+    Synchronous counterpart of chat() for a request the caller sends with
+    its own SDK client: send() must make the request described by
+    (provider, model, messages, params). Returns a ChatResponse from the
+    response cache (temperature 0 only) or from send() with retries.
+    """
+    use_cache = _cacheable(params, use_cache)
+    key = request_key(provider, model, messages, params)
+    if use_cache:
+        cached = default_response_cache().get(key)
+        if cached is not None:
+            return ChatResponse(*cached)
+
+    def timed_send():
+        start = time.perf_counter()
+        return send(), time.perf_counter() - start
+
+    raw, latency = retry_sync(timed_send)
+    response = to_chat_response(provider, raw, latency)
+    if use_cache:
+        default_response_cache().put(key, provider, model, response)
+    return response
+
+
+def send_stream(provider, model, messages, params, send, consumer, use_cache=True):
+    """
+    send_sync for a streamed request: send() must start the request as a
+    stream of the caller's SDK client. Its text deltas go to a fresh
+    consumer() per attempt as in chat_stream; returns the ChatResponse and
+    the result of the consumer's close().
+    """
+    use_cache = _cacheable(params, use_cache)
+    key = request_key(provider, model, messages, params)
+    if use_cache:
+        cached = default_response_cache().get(key)
+        if cached is not None:
+            return _replay(ChatResponse(*cached), consumer)
+
+    def attempt():
+        target = consumer()
+        response = read_stream(provider, send(), target.feed, time.perf_counter())
+        return response, target.close()
+
+    response, result = retry_sync(attempt)
+    if use_cache:
+        default_response_cache().put(key, provider, model, response)
+    return response, result
+
+
+# Two-turn conversations (fix_response, explanation_response) as in run_*
+
+async def two_turn(provider, model, problem_prompt, followup_prompt, stream=None, **params):
+    """
+    Runs the problem prompt, then the follow-up prompt with the first answer
+    in context, and returns (fix_response, explanation_response). Raises a
+    ChatError if either turn fails permanently.
+
+    With stream (e.g. scoring.StreamingDistance), the explanation turn is
+    streamed into stream(fix_response) and the result of its close() (the
+    distance) is returned as a third value.
+    """
+    messages = [{"role": "user", "content": problem_prompt}]
+    fix_response = (await chat(provider, model, messages, **params)).text
+    messages.append({"role": "assistant", "content": fix_response})
+    messages.append({"role": "user", "content": followup_prompt})
+    if stream is not None:
+        response, streamed = await chat_stream(provider, model, messages, lambda: stream(fix_response), **params)
+        return fix_response, response.text, streamed
+    explanation_response = (await chat(provider, model, messages, **params)).text
+    return fix_response, explanation_response
+
+
+async def gather_conversations(provider, model, samples, concurrency=16, rate_limit=None,
+                               adaptive=True, stream=None, **params):
+    """
+    Runs two_turn for every sample (dicts with problem_prompt and
+    followup_prompt) with at most `concurrency` conversations in flight.
+    With adaptive=True, `concurrency` is only the ceiling and the requests
+    in flight follow the model's adaptive limit. rate_limit ({"rpm": ...,
+    "tpm": ...}) sets the model's quota. Returns the (fix_response,
+    explanation_response) pairs (with stream, two_turn's triples) in
+    sample order, with None for samples whose conversation failed
+    permanently; those are added to the dead-letter list.
+    """
+    if rate_limit:
+        set_quota(provider, model, **rate_limit)
+    if adaptive:
+        adaptive_limit(provider, model, maximum=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(sample):
+        async with semaphore:
+            try:
+                return await two_turn(provider, model, sample["problem_prompt"], sample["followup_prompt"],
+                                      stream, **params)
+            except ChatError as e:
+                add_dead_letter(provider, model, sample, e, **params)
+                return None
+
+    try:
+        return await asyncio.gather(*(run(sample) for sample in samples))
+    finally:
+        await close_clients()
+
+
+def prefetch_conversations(provider, model, samples, concurrency=16, rate_limit=None, adaptive=True,
+                           stream=None, **params):
+    """
+    Blocking wrapper around gather_conversations for the run_* loops.
+    """
+    return asyncio.run(gather_conversations(provider, model, samples, concurrency, rate_limit,
+                                            adaptive, stream, **params))
+
+
+def run_conversations(provider, model, samples, ask, label="", concurrency=1, rate_limit=None,
+                      save_file=None, use_cache=True, stream=None, **params):
+    """
+    The conversations of a run_* function: returns (sample, fix_response,
+    explanation_response, streamed) for every sample whose two turns
+    succeeded, in sample order. With concurrency > 1 all conversations run
+    up front through prefetch_conversations, at most `concurrency` at a
+    time (fewer while the model's adaptive limit is lower); otherwise one
+    at a time with ask(messages, model=model), the script's own
+    synchronous SDK call.
+
+    With stream (e.g. scoring.StreamingDistance), the explanation turn is
+    streamed into stream(fix_response) (through ask(messages, model=model,
+    stream=...), which then returns the text and the consumer's result)
+    and streamed is the result of its close(); otherwise streamed is None.
+
+    Samples that fail for good produce no row; they go to the dead-letter
+    list, which is written next to save_file.
+    """
+    responses = (prefetch_conversations(provider, model, samples, concurrency, rate_limit,
+                                        stream=stream, use_cache=use_cache, **params)
+                 if concurrency > 1 else None)
+    rows = []
+    for i, sample in enumerate(samples):
+        print(f"[{label} {i + 1}/{len(samples)}] Prompt: {sample['problem_prompt']}")
+        if responses is not None:
+            # None: already in the dead-letter list from the concurrent path
+            if responses[i] is not None:
+                rows.append((sample, *responses[i]) if stream else (sample, *responses[i], None))
+            continue
+        try:
+            # Initialize conversation history with the initial prompt
+            messages = [{"role": "user", "content": sample["problem_prompt"]}]
+            # Get the first response (fix_response)
+            fix_response = ask(messages, model=model)
+            # Append the assistant response and the followup prompt to the context
+            messages.append({"role": "assistant", "content": fix_response})
+            messages.append({"role": "user", "content": sample["followup_prompt"]})
+            # Get the explanation response using full context
+            if stream is not None:
+                explanation_response, streamed = ask(messages, model=model, stream=lambda: stream(fix_response))
+            else:
+                explanation_response, streamed = ask(messages, model=model), None
+        except ChatError as e:
+            add_dead_letter(provider, model, sample, e, **params)
+            print(f"Failed ({type(e).__name__}): {e}")
+            continue
+        rows.append((sample, fix_response, explanation_response, streamed))
+
+    if save_file is not None:
+        dead_letter_path = write_dead_letters(save_file, pop_dead_letters())
+        if dead_letter_path:
+            print(f"{len(samples) - len(rows)} failed prompts saved to {dead_letter_path}")
+    return rows
+
+
+def chat_stats(provider, model):
+    """
+    Adaptive concurrency and response cache statistics of a run, for its
+    metadata.
+    """
+    return {"concurrency": concurrency_stats(provider, model), "response_cache": response_cache_stats()}
+
+
+def retry_dead_letters(entries, concurrency=16):
+    """
+    Bulk retry of dead-letter entries (dead_letters.read_dead_letters):
+    reruns each entry's conversation with its provider, model and params
+    and returns (entry, (fix_response, explanation_response) or None)
+    pairs. Entries that fail again are added to the dead-letter list anew.
+    """
+    groups = {}
+    for entry in entries:
+        key = (entry["provider"], entry["model"], json.dumps(entry["params"], sort_keys=True))
+        groups.setdefault(key, []).append(entry)
+    results = []
+    for (provider, model, _), group in groups.items():
+        pairs = prefetch_conversations(provider, model, [entry["sample"] for entry in group], concurrency,
+                                       **group[0]["params"])
+        results.extend(zip(group, pairs))
+    return results
@@ -0,0 +1,76 @@
+"""
+Dead-letter list of prompts whose conversation failed permanently.
+
+A sample whose request still failed after all retries (or failed with a
+non-retryable error) produces no result row; it is recorded here with the
+provider, model, request parameters and error instead. The run functions
+write the entries next to their results as "<name>-dead-letters.jsonl";
+dead_letter_samples() reads the samples back for a later bulk retry.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+
+
+_dead_letters = []
+
+
+def add_dead_letter(provider, model, sample, error, **params):
+    """
+    Records a sample whose conversation failed with error.
+    """
+    _dead_letters.append({
+        "failed": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "provider": provider,
+        "model": model,
+        "params": params,
+        "error": type(error).__name__,
+        "message": str(error),
+        "sample": sample,
+    })
+
+
+def dead_letters():
+    return list(_dead_letters)
+
+
+def pop_dead_letters():
+    """
+    Returns the recorded entries and empties the list.
+    """
+    entries = list(_dead_letters)
+    _dead_letters.clear()
+    return entries
+
+
+def dead_letter_file(save_file):
+    root, _ = os.path.splitext(save_file)
+    return f"{root}-dead-letters.jsonl"
+
+
+def write_dead_letters(save_file, entries):
+    """
+    Writes entries as JSON lines next to save_file and returns the path,
+    or None if there are none.
+    """
+    if not entries:
+        return None
+    path = dead_letter_file(save_file)
+    with open(path, "w", encoding="utf-8") as handle:
+        for entry in entries:
+            handle.write(json.dumps(entry, default=str) + "\n")
+    return path
+
+
+def read_dead_letters(path):
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def dead_letter_samples(path):
+    """
+    The samples of a dead-letter file, to pass as samples= to a run
+    function.
+    """
+    return [entry["sample"] for entry in read_dead_letters(path)]
@@ -0,0 +1,251 @@
+"""
+Typed chat failures and retries with exponential backoff.
+
+Provider SDK exceptions are mapped onto a small hierarchy (rate limit,
+timeout, server, content filter, auth) by HTTP status and exception name,
+so the same handling works for openai, anthropic and google-genai, sync or
+async. Other exceptions (bugs in the calling code, SDK misuse) are not
+chat failures and propagate unchanged. Rate limits, timeouts and server errors are retried with jittered
+exponential backoff, waiting at least as long as the provider's
+Retry-After header asks; everything else, and the last failed attempt,
+raises the typed error instead of returning it as a model answer.
+"""
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+class ChatError(Exception):
+    """
+    A failed chat request. retryable tells whether sending it again can
+    succeed; status and retry_after come from the provider's response.
+    """
+
+    retryable = False
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RateLimitError(ChatError):
+    retryable = True
+
+
+class ChatTimeoutError(ChatError):
+    retryable = True
+
+
+class ServerError(ChatError):
+    retryable = True
+
+
+class ContentFilterError(ChatError):
+    pass
+
+
+class AuthError(ChatError):
+    pass
+
+
+# Classification of SDK exceptions
+
+def _status(error):
+    for name in ("status_code", "http_status", "code"):
+        status = getattr(error, name, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def retry_after(error):
+    """
+    Seconds the provider asked to wait (Retry-After / retry-after-ms
+    headers of the error's response), or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Exception names of dropped connections (openai/anthropic APIConnectionError,
+# httpx ConnectError, ReadError, RemoteProtocolError, ...)
+_TRANSIENT_NAMES = ("Connect", "ReadError", "WriteError", "RemoteProtocol", "ServiceUnavailable")
+
+_api_errors = None
+
+
+def _api_error_types():
+    """
+    Base classes of the request errors raised by the installed SDKs and
+    their HTTP transport.
+    """
+    global _api_errors
+    if _api_errors is None:
+        types = [asyncio.TimeoutError, TimeoutError]
+        try:
+            import openai
+            types.append(openai.APIError)
+        except ImportError:
+            pass
+        try:
+            import anthropic
+            types.append(anthropic.APIError)
+        except ImportError:
+            pass
+        try:
+            from google.genai import errors
+            types.append(errors.APIError)
+        except ImportError:
+            pass
+        try:
+            import httpx
+            types.append(httpx.TransportError)
+        except ImportError:
+            pass
+        _api_errors = tuple(types)
+    return _api_errors
+
+
+def classify(error):
+    """
+    The ChatError subclass instance for an SDK request error. ChatErrors
+    and exceptions that are not request errors (no HTTP status, not an
+    SDK API or transport error) are returned unchanged.
+    """
+    if isinstance(error, ChatError):
+        return error
+    status = _status(error)
+    if status is None and not isinstance(error, _api_error_types()):
+        return error
+    name = type(error).__name__
+    message = f"{name}: {error}"
+    wait = retry_after(error)
+    if status == 429 or "RateLimit" in name or "ResourceExhausted" in name:
+        return RateLimitError(message, status, wait)
+    if status in (401, 403) or "Authentication" in name or "PermissionDenied" in name:
+        return AuthError(message, status)
+    if "content_filter" in str(error) or (status == 400 and "safety" in str(error).lower()):
+        return ContentFilterError(message, status)
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in name or status == 408:
+        return ChatTimeoutError(message, status, wait)
+    if (status is not None and status >= 500) or any(part in name for part in _TRANSIENT_NAMES):
+        return ServerError(message, status, wait)
+    return ChatError(message, status)
+
+
+# Responses that arrived but carry no answer
+
+_GEMINI_BLOCKED = ("SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "SPII", "RECITATION")
+
+
+def check_response(provider, response):
+    """
+    Raises ContentFilterError if the provider's response was blocked, cut
+    off by its content filter or refused by the model.
+    """
+    if provider == "openai":
+        choice = response.choices[0] if response.choices else None
+        reason = choice.finish_reason if choice else None
+        refusal = getattr(choice.message, "refusal", None) if choice else None
+        blocked = reason == "content_filter" or bool(refusal)
+        if refusal and reason != "content_filter":
+            reason = "refusal"
+    elif provider == "anthropic":
+        reason = response.stop_reason
+        blocked = reason == "refusal"
+    else:
+        feedback = getattr(response, "prompt_feedback", None)
+        reason = getattr(feedback, "block_reason", None)
+        if reason is None and response.candidates:
+            reason = response.candidates[0].finish_reason
+        reason = getattr(reason, "name", reason)
+        blocked = not response.candidates or reason in _GEMINI_BLOCKED
+    if blocked:
+        raise ContentFilterError(f"{provider} response blocked ({reason})")
+
+
+def check_stream(provider, state):
+    """
+    check_response for a streamed response, from the stop reason, refusal
+    and candidates seen in its events (client.stream_delta).
+    """
+    reason = state.get("reason")
+    if provider == "openai":
+        if state.get("refusal") and reason != "content_filter":
+            reason = "refusal"
+        blocked = reason in ("content_filter", "refusal")
+    elif provider == "anthropic":
+        blocked = reason == "refusal"
+    else:
+        blocked = not state.get("candidates") or reason in _GEMINI_BLOCKED
+    if blocked:
+        raise ContentFilterError(f"{provider} response blocked ({reason})")
+
+
+# Retries
+
+MAX_ATTEMPTS = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+def backoff_delay(attempt, error):
+    """
+    Seconds to wait before retry number `attempt` (0-based): full-jitter
+    exponential backoff, or Retry-After plus up to BASE_DELAY of jitter
+    when the provider sent one.
+    """
+    if error.retry_after is not None:
+        return error.retry_after + random.uniform(0, BASE_DELAY)
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+def retry_sync(call, attempts=MAX_ATTEMPTS):
+    """
+    Calls call() until it succeeds, sleeping backoff_delay between
+    retryable failures; raises the typed error otherwise, and exceptions
+    that are not request errors as they are.
+    """
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception as e:
+            error = classify(e)
+            if not isinstance(error, ChatError) or not error.retryable or attempt == attempts - 1:
+                if error is e:
+                    raise
+                raise error from e
+            time.sleep(backoff_delay(attempt, error))
+
+
+async def retry_async(call, attempts=MAX_ATTEMPTS):
+    """
+    retry_sync for a coroutine function.
+    """
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as e:
+            error = classify(e)
+            if not isinstance(error, ChatError) or not error.retryable or attempt == attempts - 1:
+                if error is e:
+                    raise
+                raise error from e
+            await asyncio.sleep(backoff_delay(attempt, error))
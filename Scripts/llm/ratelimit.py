@@ -0,0 +1,158 @@
+"""
+Requests-per-minute / tokens-per-minute limits per (provider, model).
+
+Each limited model has two token buckets. Before a request is dispatched
+its quota cost (prompt tokens counted with tiktoken plus the requested
+completion length) is taken from the TPM bucket and one request from the
+RPM bucket, waiting for refill if either is short; once the response
+arrives the estimate is replaced by the usage the provider reported. The
+scripts thus stay just under their quota instead of running into 429s.
+"""
+
+import asyncio
+import time
+
+
+# Token buckets
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units per minute up to one minute's worth.
+    acquire() waits until the requested amount is available; adjust() adds
+    or removes units afterwards, and the level may go negative, so usage
+    that exceeded an estimate delays later requests instead of being lost.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute quota of one (provider,
+    model). A request is dispatched only when both buckets can cover it;
+    its token cost is estimated up front and corrected with the usage the
+    provider reports.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waited = 0.0
+
+    async def acquire(self, estimated_tokens):
+        start = time.monotonic()
+        while True:
+            wait = max(self.requests.wait_time(1) if self.requests else 0.0,
+                       self.tokens.wait_time(estimated_tokens) if self.tokens else 0.0)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        # No await between the check and taking, so concurrent tasks cannot
+        # both pass the same check
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(estimated_tokens)
+        self.waited += time.monotonic() - start
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        """
+        Returns over-estimated tokens to the bucket or charges the excess.
+        """
+        if self.tokens and actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+
+# Quotas per (provider, model)
+
+_limiters = {}
+
+
+def set_quota(provider, model, rpm=None, tpm=None):
+    """
+    Rate-limits chat() calls to a model; rpm=tpm=None removes the limit.
+    """
+    if rpm or tpm:
+        _limiters[(provider, model)] = RateLimiter(rpm, tpm)
+    else:
+        _limiters.pop((provider, model), None)
+
+
+def limiter_for(provider, model):
+    return _limiters.get((provider, model))
+
+
+# Token estimates
+
+# Expected completion length when the request sets no max_tokens
+DEFAULT_OUTPUT_TOKENS = 1024
+# Formatting tokens per message in the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# Encoding for models tiktoken does not know (Anthropic, Gemini)
+DEFAULT_ENCODING = "o200k_base"
+
+# model -> tiktoken encoding, or None if it could not be loaded
+_encodings = {}
+
+
+def count_tokens(text, model):
+    """
+    Tokens of a text with the model's tiktoken encoding (DEFAULT_ENCODING
+    for non-OpenAI models); about 4 characters per token if tiktoken or
+    the encoding is not available.
+    """
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception:
+            # tiktoken missing or its BPE file cannot be downloaded
+            _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_tokens(model, messages, params):
+    """
+    Quota tokens a request will use: the prompt tokens plus its
+    max_tokens (or DEFAULT_OUTPUT_TOKENS), which is what providers reserve
+    against the TPM limit.
+    """
+    prompt = sum(count_tokens(str(message["content"]), model) + MESSAGE_OVERHEAD_TOKENS
+                 for message in messages)
+    if params.get("system"):
+        prompt += count_tokens(params["system"], model)
+    output = (params.get("max_tokens") or params.get("max_completion_tokens")
+              or params.get("max_output_tokens") or DEFAULT_OUTPUT_TOKENS)
+    return prompt + output
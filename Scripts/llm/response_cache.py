@@ -0,0 +1,110 @@
+"""
+Persistent cache of chat responses keyed by the full request.
+
+A request is identified by the sha256 of its canonical JSON form: provider,
+model, the role / content of every message and all request parameters
+(temperature, max_tokens, system prompt, ...), with sorted keys. The
+response text, token usage and the latency of the original call are
+stored in SQLite, so re-running a script at temperature 0 reads the
+answers back instead of paying for them again. Requests at any other
+temperature, or without one (the provider's default), sample a new
+answer on every call and bypass the cache in both directions, as do
+requests sent with use_cache=False.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+
+DEFAULT_PATH = os.environ.get("LLM_RESPONSE_CACHE", "llm-response-cache.sqlite")
+
+
+def request_key(provider, model, messages, params):
+    """
+    Content address of a chat request.
+    """
+    request = {
+        "provider": provider,
+        "model": model,
+        "messages": [{"role": message["role"], "content": message["content"]} for message in messages],
+        "params": params,
+    }
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of (text, input_tokens, output_tokens, latency)
+    per request key.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, provider TEXT, model TEXT, text TEXT,"
+            " input_tokens INTEGER, output_tokens INTEGER, latency REAL, created TEXT) WITHOUT ROWID")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        (text, input_tokens, output_tokens, latency) stored under key, or
+        None.
+        """
+        row = self.connection.execute(
+            "SELECT text, input_tokens, output_tokens, latency FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def put(self, key, provider, model, response):
+        """
+        Stores a ChatResponse under key.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, provider, model, response.text, response.input_tokens, response.output_tokens,
+             response.latency, datetime.now(timezone.utc).isoformat(timespec="seconds")))
+        self.connection.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+_default_response_cache = None
+
+
+def default_response_cache():
+    """
+    The process-wide ResponseCache at DEFAULT_PATH, opened on first use.
+    """
+    global _default_response_cache
+    if _default_response_cache is None:
+        _default_response_cache = ResponseCache()
+    return _default_response_cache
+
+
+def response_cache_stats():
+    """
+    stats() of the default cache, or None if it was not used.
+    """
+    return _default_response_cache.stats() if _default_response_cache is not None else None
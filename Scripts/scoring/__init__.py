@@ -0,0 +1,55 @@
+"""
+Shared scoring utilities for the LLM decision-making experiments.
+
+The run_*_experiment functions in the Scripts/*-no-key.py files score each
+response pair with profile_columns and gram_distance_columns from here and
+record the run with write_run_metadata (and write_edit_scripts on request);
+rescore re-scores their saved results.
+"""
+
+from .ngrams import (
+    tokenize,
+    tokenize_batch,
+    use_tokenizer,
+    current_tokenizer,
+    to_3grams,
+    intern_grams,
+    gram_id_arrays,
+)
+from .fast_tokenizer import fast_word_tokenize, fast_tokenize_batch
+from .cache import TokenCache, default_cache, text_digest
+from .distance import (
+    BACKENDS,
+    dp_distance,
+    wavefront_distance,
+    bitparallel_distance,
+    diagonal_distance,
+    trim_common_affixes,
+    auto_backend,
+    choose_backend,
+    select_backend,
+    select_text_backend,
+    use_backend,
+    selected_backend,
+    use_selection,
+    describe_selection,
+    int_edit_distance,
+    edit_distance,
+    within_distance,
+    distance_budget,
+    within_normalized_distance,
+    gram_distances,
+    gram_distance_columns,
+)
+from .align import align, script_distance, response_edit_script, write_edit_scripts
+from .rescore import rescore, rescore_workbook, score_pair, available_metrics
+from .streaming import StreamingDistance, score_stream
+from .matrix import pairwise_distances, domain_distances, triangle_tiles
+from .minhash import LSHIndex, minhash_signature, write_signatures, index_results
+from .filters import filter_cascade, distances_within, pairs_within
+from .bpe import encoding_for, encode_batch, bpe_distances, bpe_distance_columns, bpe_distance_batch
+from .metadata import run_metadata, write_run_metadata
+from .distance_cache import DistanceCache, default_distance_cache, cached_distance
+from .chunked import split_chunks, chunked_distance, chunked_normalized_distance
+from .profile import alignment_profile, distance_profile, normalized_columns, profile_columns, ALIGNMENT_COLUMNS
+from .conversation import ConversationScorer
@@ -0,0 +1,167 @@
+import json
+import os
+
+import numpy as np
+
+from .ngrams import to_3grams, intern_grams
+
+
+# Hirschberg alignment: the edit script between two gram sequences in
+# O(len(a) + len(b)) memory instead of a full traceback table.
+
+# Sub-problems at or below this many DP cells are solved with a full table.
+FULL_TABLE_CELLS = 4096
+
+
+def _last_row(a, b):
+    """
+    Returns the last row of the Levenshtein DP table of a against b, keeping
+    only one row in memory. The left-to-right insertion chain inside a row
+    is resolved with a running minimum, so each row is a few NumPy calls.
+    """
+    offsets = np.arange(len(b) + 1, dtype=np.int64)
+    row = offsets.copy()
+    for i in range(1, len(a) + 1):
+        row = next_row(row, b, a[i - 1], i, offsets)
+    return row
+
+
+def next_row(row, b, gram, i, offsets):
+    """
+    Extends the DP by one gram: given row i - 1 of the table of a against b
+    and a[i - 1] = gram, returns row i.
+    """
+    candidate = np.empty(len(row), dtype=np.int64)
+    candidate[0] = i
+    np.minimum(row[1:] + 1, row[:-1] + (b != gram), out=candidate[1:])
+    # current[j] = min over j' <= j of candidate[j'] + (j - j')
+    return np.minimum.accumulate(candidate - offsets) + offsets
+
+
+def _full_table_script(a, b, i0, j0, ops):
+    """
+    Appends the per-gram operations for a small sub-problem using a full
+    DP table and a traceback.
+    """
+    n, m = len(a), len(b)
+    table = np.zeros((n + 1, m + 1), dtype=np.int64)
+    table[:, 0] = np.arange(n + 1)
+    table[0, :] = np.arange(m + 1)
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            table[i, j] = min(table[i - 1, j] + 1,
+                              table[i, j - 1] + 1,
+                              table[i - 1, j - 1] + (a[i - 1] != b[j - 1]))
+    script = []
+    i, j = n, m
+    while i or j:
+        if i and j and table[i, j] == table[i - 1, j - 1] + (a[i - 1] != b[j - 1]):
+            i, j = i - 1, j - 1
+            script.append(("equal" if a[i] == b[j] else "substitute", i0 + i, j0 + j))
+        elif i and table[i, j] == table[i - 1, j] + 1:
+            i -= 1
+            script.append(("delete", i0 + i, j0 + j))
+        else:
+            j -= 1
+            script.append(("insert", i0 + i, j0 + j))
+    ops.extend(reversed(script))
+
+
+def _hirschberg(a, b, i0, j0, ops):
+    n, m = len(a), len(b)
+    if n == 0:
+        ops.extend(("insert", i0, j0 + j) for j in range(m))
+    elif m == 0:
+        ops.extend(("delete", i0 + i, j0) for i in range(n))
+    elif n == 1 or (n + 1) * (m + 1) <= FULL_TABLE_CELLS:
+        _full_table_script(a, b, i0, j0, ops)
+    else:
+        mid = n // 2
+        left = _last_row(a[:mid], b)
+        right = _last_row(a[mid:][::-1], b[::-1])[::-1]
+        split = int(np.argmin(left + right))
+        _hirschberg(a[:mid], b[:split], i0, j0, ops)
+        _hirschberg(a[mid:], b[split:], i0 + mid, j0 + split, ops)
+
+
+def align(a, b):
+    """
+    Aligns two integer gram sequences and returns the edit script as a list
+    of spans (tag, i1, i2, j1, j2), where tag is one of "equal",
+    "substitute", "delete" or "insert" and a[i1:i2] / b[j1:j2] are the
+    grams covered, in the style of difflib's get_opcodes(). The number of
+    non-equal grams in the script is the Levenshtein distance.
+    """
+    a = np.asarray(a, dtype=np.int32)
+    b = np.asarray(b, dtype=np.int32)
+    ops = []
+    _hirschberg(a, b, 0, 0, ops)
+
+    spans = []
+    for tag, i, j in ops:
+        di = 0 if tag == "insert" else 1
+        dj = 0 if tag == "delete" else 1
+        if spans and spans[-1][0] == tag and spans[-1][2] == i and spans[-1][4] == j:
+            last = spans[-1]
+            spans[-1] = (tag, last[1], i + di, last[3], j + dj)
+        else:
+            spans.append((tag, i, i + di, j, j + dj))
+    return spans
+
+
+def script_distance(spans):
+    """
+    Levenshtein distance implied by an edit script returned by align().
+    """
+    return sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in spans if tag != "equal")
+
+
+# Writing edit scripts next to the experiment CSV
+
+def _grams_text(grams):
+    """
+    Rebuilds the token text covered by a run of consecutive n-grams.
+    """
+    if not grams:
+        return ""
+    return " ".join([gram[0] for gram in grams] + list(grams[-1][1:]))
+
+
+def response_edit_script(fix_response, explanation_response):
+    """
+    Aligns the 3-grams of two responses and returns the spans together with
+    the text each non-equal span covers on either side.
+    """
+    fix_grams = to_3grams(fix_response)
+    explanation_grams = to_3grams(explanation_response)
+    a, b = intern_grams(fix_grams, explanation_grams)
+    edits = []
+    for tag, i1, i2, j1, j2 in align(a, b):
+        edit = {"op": tag, "fix": [i1, i2], "explanation": [j1, j2]}
+        if tag != "equal":
+            edit["fix_text"] = _grams_text(fix_grams[i1:i2])
+            edit["explanation_text"] = _grams_text(explanation_grams[j1:j2])
+        edits.append(edit)
+    return edits
+
+
+def edit_script_file(save_file):
+    """
+    Side-file name used for the edit scripts of an experiment CSV.
+    """
+    root, _ = os.path.splitext(save_file)
+    return f"{root}-edit-scripts.jsonl"
+
+
+def write_edit_scripts(df, save_file):
+    """
+    Writes one JSON line per row of an experiment DataFrame with the 3-gram
+    edit script between fix_response and explanation_response, next to the
+    experiment CSV. Returns the path written.
+    """
+    path = edit_script_file(save_file)
+    with open(path, "w", encoding="utf-8") as handle:
+        for index, row in df.iterrows():
+            edits = response_edit_script(str(row["fix_response"]), str(row["explanation_response"]))
+            handle.write(json.dumps({"row": int(index), "edits": edits}) + "\n")
+    return path
@@ -0,0 +1,172 @@
+"""
+Benchmarks the scoring engine against the original nltk path on the
+response pairs stored in Data/*.xlsx.
+
+Run from the Scripts directory with:  python -m scoring.benchmark
+"""
+
+import glob
+import os
+import time
+
+import nltk
+import pandas as pd
+from nltk.metrics.distance import edit_distance as nltk_edit_distance
+
+from .ngrams import to_3grams, intern_grams
+from .distance import BACKENDS, edit_distance, int_edit_distance
+from .fast_tokenizer import fast_tokenize_batch
+from .jit import NUMBA_AVAILABLE, jit_distance
+from .chunked import validate as validate_chunked
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Data")
+
+
+def load_response_pairs(pattern="Summary *.xlsx", data_dir=DATA_DIR):
+    """
+    Collects (fix_response, explanation_response) pairs from every sheet of
+    the summary workbooks that carries both columns.
+    """
+    pairs = []
+    for path in sorted(glob.glob(os.path.join(data_dir, pattern))):
+        sheets = pd.read_excel(path, sheet_name=None)
+        for sheet in sheets.values():
+            if "fix_response" not in sheet or "explanation_response" not in sheet:
+                continue
+            rows = sheet[["fix_response", "explanation_response"]].dropna()
+            pairs.extend(zip(rows["fix_response"].astype(str),
+                             rows["explanation_response"].astype(str)))
+    return pairs
+
+
+def compare_with_nltk(pairs):
+    """
+    Scores every pair with both implementations, checks that the distances
+    agree and returns the total time spent in each.
+    """
+    grams = [(to_3grams(a), to_3grams(b)) for a, b in pairs]
+
+    start = time.perf_counter()
+    reference = [nltk_edit_distance(a, b) for a, b in grams]
+    nltk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [edit_distance(a, b) for a, b in grams]
+    engine_seconds = time.perf_counter() - start
+
+    mismatches = sum(x != y for x, y in zip(reference, fast))
+    return {
+        "pairs": len(grams),
+        "mismatches": mismatches,
+        "nltk_seconds": nltk_seconds,
+        "engine_seconds": engine_seconds,
+        "speedup": nltk_seconds / engine_seconds if engine_seconds else float("inf"),
+    }
+
+
+def compare_backends(pairs):
+    """
+    Scores every pair with each backend in BACKENDS and with the automatic
+    selection, and returns the number of pairs on which any of them
+    disagree together with the time spent per backend.
+    """
+    grams = [intern_grams(to_3grams(a), to_3grams(b)) for a, b in pairs]
+    results = {}
+    seconds = {}
+    for name in list(BACKENDS) + [None]:
+        start = time.perf_counter()
+        results[name] = [int_edit_distance(a, b, name) for a, b in grams]
+        seconds[name or "auto"] = time.perf_counter() - start
+    disagreements = sum(len(set(values)) > 1 for values in zip(*results.values()))
+    return {"pairs": len(grams), "disagreements": disagreements, "seconds": seconds}
+
+
+def compare_jit(pairs):
+    """
+    Compares the Numba kernel with the pure-Python fallback path (the
+    automatic selection without numba) on the 3-gram ID arrays of the
+    pairs. Returns None if numba is not installed.
+    """
+    if not NUMBA_AVAILABLE:
+        return None
+    grams = [intern_grams(to_3grams(a), to_3grams(b)) for a, b in pairs]
+    jit_distance(*grams[0])  # compile outside the timing
+
+    start = time.perf_counter()
+    compiled = [jit_distance(a, b) for a, b in grams]
+    jit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fallback = [int_edit_distance(a, b, "bitparallel") for a, b in grams]
+    fallback_seconds = time.perf_counter() - start
+
+    return {
+        "pairs": len(grams),
+        "mismatches": sum(x != y for x, y in zip(compiled, fallback)),
+        "jit_seconds": jit_seconds,
+        "fallback_seconds": fallback_seconds,
+    }
+
+
+def compare_tokenizers(texts, batch_size=256):
+    """
+    Parity and throughput of the regex tokenizer against nltk.word_tokenize
+    on lower-cased responses. Returns the number of texts whose token lists
+    differ (with a few examples) and tokens per second for both.
+    """
+    texts = [text.lower() for text in texts]
+
+    start = time.perf_counter()
+    reference = [nltk.word_tokenize(text) for text in texts]
+    nltk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = []
+    for offset in range(0, len(texts), batch_size):
+        fast.extend(fast_tokenize_batch(texts[offset:offset + batch_size]))
+    regex_seconds = time.perf_counter() - start
+
+    mismatched = [i for i, (x, y) in enumerate(zip(reference, fast)) if x != y]
+    tokens = sum(len(t) for t in reference)
+    return {
+        "texts": len(texts),
+        "mismatches": len(mismatched),
+        "examples": [texts[i][:200] for i in mismatched[:5]],
+        "nltk_tokens_per_second": tokens / nltk_seconds if nltk_seconds else float("inf"),
+        "regex_tokens_per_second": tokens / regex_seconds if regex_seconds else float("inf"),
+    }
+
+
+if __name__ == "__main__":
+    pairs = load_response_pairs()
+    stats = compare_with_nltk(pairs)
+    print(f"{stats['pairs']} pairs, {stats['mismatches']} mismatches")
+    print(f"nltk edit_distance: {stats['nltk_seconds']:.2f}s")
+    print(f"scoring engine:     {stats['engine_seconds']:.2f}s "
+          f"({stats['speedup']:.1f}x faster)")
+
+    stats = compare_backends(pairs)
+    print(f"backends: {stats['disagreements']} disagreements over {stats['pairs']} pairs")
+    for name, seconds in stats["seconds"].items():
+        print(f"  {name:<12} {seconds:.2f}s")
+
+    stats = compare_jit(pairs)
+    if stats is None:
+        print("numba not installed: using the pure-Python kernels")
+    else:
+        print(f"numba kernel: {stats['mismatches']} mismatches over {stats['pairs']} pairs, "
+              f"{stats['jit_seconds']:.2f}s vs {stats['fallback_seconds']:.2f}s without numba")
+
+    # Chunked approximation on the longest pairs, where it is meant to be used
+    longest = sorted(pairs, key=lambda pair: len(pair[0]) * len(pair[1]), reverse=True)[:100]
+    stats = validate_chunked(longest)
+    print(f"chunked alignment on {stats['pairs']} longest pairs: "
+          f"mean deviation {stats['mean_abs_deviation']:.4f} "
+          f"(max {stats['max_abs_deviation']:.4f}, {stats['mean_relative_deviation']:.1%} relative)")
+
+    stats = compare_tokenizers([text for pair in pairs for text in pair])
+    print(f"tokenizer parity: {stats['mismatches']} of {stats['texts']} responses differ")
+    for example in stats["examples"]:
+        print(f"  {example!r}")
+    print(f"nltk.word_tokenize: {stats['nltk_tokens_per_second']:,.0f} tokens/s")
+    print(f"regex tokenizer:    {stats['regex_tokens_per_second']:,.0f} tokens/s")
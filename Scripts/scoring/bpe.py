@@ -0,0 +1,77 @@
+"""
+Edit distance over a model's own BPE tokens.
+
+The "3g edit distance" works on NLTK word 3-grams. This metric family
+encodes both responses with the tiktoken encoding of the model that wrote
+them instead, which skips NLTK tokenization and gives integer sequences
+that go straight to int_edit_distance. Encodings are loaded once per model
+and texts are encoded in batches.
+"""
+
+import functools
+
+import numpy as np
+import tiktoken
+
+from .ngrams import gram_id_arrays
+from .distance import int_edit_distance
+
+
+# Models without a tiktoken mapping (Claude, Gemini) use this encoding
+DEFAULT_ENCODING = "o200k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for(model):
+    """
+    The tiktoken Encoding for a model name, loaded once per process.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def encode_batch(texts, model="gpt-4o"):
+    """
+    BPE token ID arrays (int32) for several texts in one encode_batch call.
+    """
+    encoded = encoding_for(model).encode_batch(list(texts), disallowed_special=())
+    return [np.asarray(ids, dtype=np.int32) for ids in encoded]
+
+
+def bpe_distances(fix_response, explanation_response, model="gpt-4o", orders=(1,)):
+    """
+    Raw edit distances between the BPE token n-grams of two responses for
+    each order (order 1: the token IDs themselves).
+    """
+    tokens = encode_batch([fix_response, explanation_response], model)
+    distances = {}
+    for order in orders:
+        a, b = tokens if order == 1 else gram_id_arrays(tokens, order)
+        distances[order] = int_edit_distance(a, b)
+    return distances
+
+
+def bpe_distance_columns(fix_response, explanation_response, model="gpt-4o", orders=(1,)):
+    """
+    Result columns "bpe <n>g edit distance", normalized by the longer
+    response's character count like "3g edit distance".
+    """
+    maximum_length = max(len(fix_response), len(explanation_response))
+    if maximum_length == 0:
+        return {f"bpe {order}g edit distance": 0.0 for order in orders}
+    distances = bpe_distances(fix_response, explanation_response, model, orders)
+    return {f"bpe {order}g edit distance": distance / maximum_length
+            for order, distance in distances.items()}
+
+
+def bpe_distance_batch(pairs, model="gpt-4o", order=1):
+    """
+    Raw BPE n-gram distances for a list of (fix_response,
+    explanation_response) pairs, encoding all texts in one batch.
+    """
+    tokens = encode_batch([text for pair in pairs for text in pair], model)
+    if order != 1:
+        tokens = gram_id_arrays(tokens, order)
+    return [int_edit_distance(tokens[2 * p], tokens[2 * p + 1]) for p in range(len(pairs))]
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from .ngrams import tokenize, tokenize_batch, current_tokenizer
+
+
+# Tokenization / n-gram cache keyed by a digest of the text
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of tokenized responses. Each entry is keyed by the
+    SHA-256 digest of the text (and the active tokenizer) and holds its
+    token ID array plus the n-gram ID arrays derived from it so far. Token
+    and n-gram IDs come from vocabularies shared by every entry, so arrays
+    of different texts can be compared directly by the distance backends.
+
+    If path is given, an existing cache file is loaded on creation and
+    save() writes the cache back, so later sessions skip tokenization.
+
+    Only the entries are bounded by maxsize: the vocabularies keep every
+    token and n-gram seen since the last clear(), including those of
+    evicted entries, because arrays handed out earlier (e.g. the turns of
+    a ConversationScorer) still use their IDs. stats() reports their
+    size; call clear() between unrelated corpora to release them.
+    """
+
+    def __init__(self, maxsize=4096, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.token_vocab = {}
+        self.gram_vocab = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @staticmethod
+    def _key(text):
+        return f"{current_tokenizer()}:{text_digest(text)}"
+
+    def _store(self, key, tokens):
+        vocab = self.token_vocab
+        ids = [vocab.setdefault(token, len(vocab)) for token in tokens]
+        entry = {"tokens": np.asarray(ids, dtype=np.int32)}
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def _entry(self, text):
+        key = self._key(text)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        return self._store(key, tokenize(text))
+
+    def _batch_entries(self, texts):
+        """
+        Keys of the texts and their entries; texts not yet cached are
+        tokenized in a single batched tokenizer call.
+        """
+        keys = [self._key(text) for text in texts]
+        entries, missing = {}, {}
+        for key, text in zip(keys, texts):
+            if key in entries or key in missing:
+                continue
+            entry = self.entries.get(key)
+            if entry is None:
+                missing[key] = text
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                entries[key] = entry
+        self.misses += len(missing)
+        for key, tokens in zip(missing, tokenize_batch(list(missing.values()))):
+            entries[key] = self._store(key, tokens)
+        return keys, entries
+
+    def prime(self, texts):
+        """
+        Tokenizes all texts not yet cached in a single batched tokenizer
+        call. Only the last maxsize of them stay cached; use grams_batch
+        for batches that may be larger.
+        """
+        self._batch_entries(list(texts))
+
+    def grams_batch(self, texts, order=3):
+        """
+        N-gram ID arrays of several texts, tokenized like prime(). The
+        arrays are returned directly instead of being looked up again, so
+        texts evicted while a batch larger than maxsize is stored are not
+        re-tokenized one by one.
+        """
+        keys, entries = self._batch_entries(list(texts))
+        return [self._entry_grams(entries[key], order) for key in keys]
+
+    def tokens(self, text):
+        """
+        Token ID array of a text (tokenized as in to_3grams).
+        """
+        return self._entry(text)["tokens"]
+
+    def grams(self, text, order=3):
+        """
+        N-gram ID array of a text; equal n-grams in any cached text share
+        an ID, so grams(a, 3) vs grams(b, 3) scores like to_3grams(a) vs
+        to_3grams(b).
+        """
+        return self._entry_grams(self._entry(text), order)
+
+    def _entry_grams(self, entry, order):
+        if order not in entry:
+            tokens = entry["tokens"]
+            vocab = self.gram_vocab.setdefault(order, {})
+            if len(tokens) >= order:
+                windows = np.lib.stride_tricks.sliding_window_view(tokens, order)
+                ids = [vocab.setdefault(row.tobytes(), len(vocab)) for row in windows]
+            else:
+                ids = []
+            entry[order] = np.asarray(ids, dtype=np.int32)
+        return entry[order]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "token_vocab": len(self.token_vocab),
+            "gram_vocab": sum(len(vocab) for vocab in self.gram_vocab.values()),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.token_vocab.clear()
+        self.gram_vocab.clear()
+        self.hits = self.misses = 0
+
+    def save(self, path=None):
+        path = path or self.path
+        with open(path, "wb") as handle:
+            pickle.dump({
+                "entries": self.entries,
+                "token_vocab": self.token_vocab,
+                "gram_vocab": self.gram_vocab,
+            }, handle)
+
+    def load(self, path):
+        with open(path, "rb") as handle:
+            state = pickle.load(handle)
+        self.entries = state["entries"]
+        self.token_vocab = state["token_vocab"]
+        self.gram_vocab = state["gram_vocab"]
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+default_cache = TokenCache()
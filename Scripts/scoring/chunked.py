@@ -0,0 +1,177 @@
+"""
+Approximate 3-gram edit distance for very long responses, computed per
+paragraph.
+
+Both responses are split on Markdown paragraph and step boundaries (blank
+lines, headings, list items). The chunks are aligned to each other with a
+cheap chunk-level cost (3-gram set overlap), and
+exact 3-gram DP runs only on matched chunk pairs, optionally in parallel.
+Unmatched chunks count as deleted / inserted grams.
+
+The chunk alignment is one valid alignment of the chunk gram sequences,
+so it can only overestimate their distance; 3-grams that span a chunk
+boundary are not counted. validate() reports the deviation from the exact
+"3g edit distance" on a set of pairs.
+"""
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .distance import int_edit_distance, gram_distances
+from .ngrams import gram_id_arrays, tokenize_batch
+
+
+# A new chunk starts after a blank line and at every heading, list item or
+# numbered step
+_CHUNK_START = re.compile(r"\n\s*\n|\n(?=[ \t]*(?:#{1,6}\s|[*+-]\s|\d+[.)]\s|\*\*step))", re.IGNORECASE)
+
+
+def split_chunks(text):
+    """
+    Splits a response into Markdown paragraphs / steps.
+    """
+    return [chunk for chunk in _CHUNK_START.split(text) if chunk.strip()]
+
+
+def chunk_grams(fix_response, explanation_response, order=3):
+    """
+    Splits both responses into chunks and returns one n-gram ID array per
+    chunk for each response, with IDs shared across both.
+    """
+    fix_chunks = split_chunks(fix_response)
+    explanation_chunks = split_chunks(explanation_response)
+    tokens = tokenize_batch(fix_chunks + explanation_chunks)
+    vocab = {}
+    ids = [np.asarray([vocab.setdefault(token, len(vocab)) for token in chunk], dtype=np.int32)
+           for chunk in tokens]
+    grams = gram_id_arrays(ids, order)
+    return grams[:len(fix_chunks)], grams[len(fix_chunks):]
+
+
+# Chunk-level alignment
+
+def chunk_costs(fix_grams, explanation_grams):
+    """
+    Cheap matching cost for every chunk pair: half the size of the
+    symmetric difference of their 3-gram sets, from one product of the
+    chunk-by-gram presence matrices.
+    """
+    vocab = np.unique(np.concatenate(list(fix_grams) + list(explanation_grams)))
+
+    def presence(chunks):
+        matrix = np.zeros((len(chunks), len(vocab)), dtype=np.float32)
+        for row, grams in enumerate(chunks):
+            matrix[row, np.searchsorted(vocab, grams)] = 1.0
+        return matrix
+
+    fix_presence = presence(fix_grams)
+    explanation_presence = presence(explanation_grams)
+    shared = fix_presence @ explanation_presence.T
+    sizes = fix_presence.sum(axis=1)[:, None] + explanation_presence.sum(axis=1)[None, :]
+    return np.ceil((sizes - 2 * shared) / 2).astype(np.int64)
+
+
+def align_chunks(fix_grams, explanation_grams):
+    """
+    Needleman-Wunsch over chunks: matching two chunks costs chunk_costs,
+    leaving a chunk unmatched costs its gram count. Each table row is a few
+    NumPy calls (the running-minimum trick of align._last_row with
+    per-chunk gap costs). Returns the matched (i, j) chunk pairs in order.
+    """
+    p, q = len(fix_grams), len(explanation_grams)
+    if not p or not q:
+        return []
+    fix_sizes = np.array([len(g) for g in fix_grams], dtype=np.int64)
+    explanation_offsets = np.concatenate([[0], np.cumsum([len(g) for g in explanation_grams])])
+    match = chunk_costs(fix_grams, explanation_grams)
+
+    table = np.empty((p + 1, q + 1), dtype=np.int64)
+    table[0] = explanation_offsets
+    for i in range(1, p + 1):
+        candidate = np.empty(q + 1, dtype=np.int64)
+        candidate[0] = table[i - 1, 0] + fix_sizes[i - 1]
+        np.minimum(table[i - 1, :-1] + match[i - 1], table[i - 1, 1:] + fix_sizes[i - 1],
+                   out=candidate[1:])
+        # Leaving explanation chunks j'..j-1 unmatched costs their gram count
+        table[i] = np.minimum.accumulate(candidate - explanation_offsets) + explanation_offsets
+
+    pairs = []
+    i, j = p, q
+    while i and j:
+        if table[i, j] == table[i - 1, j - 1] + match[i - 1, j - 1]:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif table[i, j] == table[i - 1, j] + fix_sizes[i - 1]:
+            i -= 1
+        else:
+            j -= 1
+    return pairs[::-1]
+
+
+def _pair_distance(pair):
+    return int_edit_distance(*pair)
+
+
+def chunked_distance(fix_response, explanation_response, workers=1, executor=None):
+    """
+    Approximate 3-gram edit distance: exact DP on aligned chunk pairs plus
+    the gram counts of unmatched chunks. Matched pairs are scored in a
+    process pool when workers > 1 (or on the given executor).
+    """
+    fix_grams, explanation_grams = chunk_grams(fix_response, explanation_response)
+    pairs = align_chunks(fix_grams, explanation_grams)
+    matched = [(fix_grams[i], explanation_grams[j]) for i, j in pairs]
+
+    if executor is not None:
+        distances = list(executor.map(_pair_distance, matched))
+    elif workers > 1 and len(matched) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            distances = list(pool.map(_pair_distance, matched))
+    else:
+        distances = [_pair_distance(pair) for pair in matched]
+
+    unmatched = (sum(len(g) for g in fix_grams) + sum(len(g) for g in explanation_grams)
+                 - sum(len(a) + len(b) for a, b in matched))
+    return sum(distances) + unmatched
+
+
+def chunked_normalized_distance(fix_response, explanation_response):
+    """
+    chunked_distance divided by the longer response's character count, the
+    approximate counterpart of the "3g edit distance" column.
+    """
+    maximum_length = max(len(fix_response), len(explanation_response))
+    if maximum_length == 0:
+        return 0.0
+    return chunked_distance(fix_response, explanation_response) / maximum_length
+
+
+# Validation against the exact distance
+
+def validate(pairs, workers=None):
+    """
+    Compares the chunked approximation of the normalized "3g edit distance"
+    with the exact value on (fix_response, explanation_response) pairs and
+    returns the mean and maximum absolute deviation, the mean relative
+    deviation and the share of pairs where both agree exactly.
+    """
+    exact, approximate = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for fix_response, explanation_response in pairs:
+            maximum_length = max(len(fix_response), len(explanation_response)) or 1
+            exact.append(gram_distances(fix_response, explanation_response, (3,))[3] / maximum_length)
+            approximate.append(chunked_distance(fix_response, explanation_response,
+                                                executor=pool) / maximum_length)
+    exact = np.array(exact)
+    approximate = np.array(approximate)
+    deviation = approximate - exact
+    relative = np.divide(deviation, exact, out=np.zeros_like(deviation), where=exact > 0)
+    return {
+        "pairs": len(exact),
+        "mean_abs_deviation": float(np.mean(np.abs(deviation))) if len(exact) else 0.0,
+        "max_abs_deviation": float(np.max(np.abs(deviation))) if len(exact) else 0.0,
+        "mean_relative_deviation": float(np.mean(relative)) if len(exact) else 0.0,
+        "exact_share": float(np.mean(deviation == 0)) if len(exact) else 0.0,
+    }
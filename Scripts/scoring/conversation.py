@@ -0,0 +1,88 @@
+"""
+Scoring of multi-turn conversation chains (fix -> explanation -> further
+follow-ups).
+
+Each turn is tokenized once when it is added; its n-gram ID arrays come
+from the shared token cache, so adding a turn costs one tokenization plus
+the distances of the new pairs (previous turn -> new turn and first turn ->
+new turn). Other pairs are computed on request and memoized.
+"""
+
+from .cache import default_cache
+from .distance import int_edit_distance
+
+
+class ConversationScorer:
+    """
+    Edit distances between the turns of one conversation, for every n-gram
+    order in orders. Distances are normalized by the longer turn's
+    character count like "3g edit distance".
+    """
+
+    def __init__(self, turns=(), orders=(3,), cache=None):
+        self.orders = tuple(orders)
+        self.cache = cache or default_cache
+        self.turns = []
+        self.grams = []
+        self.distances = {}
+        for text in turns:
+            self.add_turn(text)
+
+    def add_turn(self, text):
+        """
+        Adds the next turn, scores it against the previous and the first
+        turn, and returns its index.
+        """
+        text = str(text)
+        self.turns.append(text)
+        self.grams.append({order: self.cache.grams(text, order) for order in self.orders})
+        k = len(self.turns) - 1
+        for order in self.orders if k else ():
+            self.raw_distance(k - 1, k, order)
+            self.raw_distance(0, k, order)
+        return k
+
+    def raw_distance(self, i, j, order=None):
+        """
+        Raw n-gram edit distance between turns i and j (memoized).
+        """
+        order = order or self.orders[0]
+        i, j = min(i, j), max(i, j)
+        key = (i, j, order)
+        if key not in self.distances:
+            self.distances[key] = int_edit_distance(self.grams[i][order], self.grams[j][order])
+        return self.distances[key]
+
+    def distance(self, i, j, order=None):
+        """
+        Normalized n-gram edit distance between turns i and j.
+        """
+        maximum_length = max(len(self.turns[i]), len(self.turns[j]))
+        raw = self.raw_distance(i, j, order)
+        return raw / maximum_length if maximum_length else 0.0
+
+    def consecutive(self, order=None):
+        """
+        Distances between each turn and the one before it (k - 1 -> k).
+        """
+        return [self.distance(k - 1, k, order) for k in range(1, len(self.turns))]
+
+    def from_first(self, order=None):
+        """
+        Distances between the first turn and every later turn (0 -> k).
+        """
+        return [self.distance(0, k, order) for k in range(1, len(self.turns))]
+
+    def rows(self):
+        """
+        One dict per turn after the first with the consecutive and
+        first-to-turn distances for every order, ready for a DataFrame.
+        """
+        rows = []
+        for k in range(1, len(self.turns)):
+            row = {"turn": k}
+            for order in self.orders:
+                row[f"consecutive {order}g edit distance"] = self.distance(k - 1, k, order)
+                row[f"first-to-turn {order}g edit distance"] = self.distance(0, k, order)
+            rows.append(row)
+        return rows
@@ -0,0 +1,509 @@
+import time
+
+import numpy as np
+from nltk.metrics.distance import edit_distance as nltk_edit_distance
+
+from .ngrams import intern_grams
+from .cache import default_cache
+from .jit import NUMBA_AVAILABLE, jit_distance
+
+try:
+    from rapidfuzz.distance import Levenshtein as rapidfuzz_levenshtein
+except ImportError:
+    rapidfuzz_levenshtein = None
+
+
+# Reference Levenshtein DP (row by row, same recurrence as nltk edit_distance)
+
+def dp_distance(a, b):
+    """
+    Computes the Levenshtein distance between two integer sequences
+    with a plain two-row dynamic program.
+    """
+    a = [int(x) for x in a]
+    b = [int(x) for x in b]
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+# NumPy anti-diagonal wavefront
+
+def wavefront_distance(a, b):
+    """
+    Computes the Levenshtein distance between two integer arrays by sweeping
+    the DP table one anti-diagonal at a time. Every cell on a diagonal only
+    depends on the two previous diagonals, so each sweep is a handful of
+    vectorized NumPy operations instead of a Python loop over cells.
+
+    Diagonal d holds the cells D[i][d - i] and is stored indexed by i.
+    """
+    a = np.asarray(a, dtype=np.int32)
+    b = np.asarray(b, dtype=np.int32)
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return max(n, m)
+
+    # Reversing b turns the b[j - 1] lookups along a diagonal into a slice
+    b_reversed = b[::-1].copy()
+    two_back = np.zeros(n + 1, dtype=np.int32)  # diagonal 0: D[0][0] = 0
+    one_back = np.ones(n + 1, dtype=np.int32)   # diagonal 1: D[0][1] = D[1][0] = 1
+    current = np.empty(n + 1, dtype=np.int32)
+    for d in range(2, n + m + 1):
+        lo = max(1, d - m)
+        hi = min(n, d - 1)
+        if lo <= hi:
+            # b[j - 1] for j = d - lo ... d - hi lives at b_reversed[m - d + lo ...]
+            mismatch = a[lo - 1:hi] != b_reversed[m - d + lo:m - d + hi + 1]
+            np.add(two_back[lo - 1:hi], mismatch, out=current[lo:hi + 1])
+            np.minimum(current[lo:hi + 1], one_back[lo - 1:hi] + 1, out=current[lo:hi + 1])
+            np.minimum(current[lo:hi + 1], one_back[lo:hi + 1] + 1, out=current[lo:hi + 1])
+        if d <= m:
+            current[0] = d
+        if d <= n:
+            current[d] = d
+        two_back, one_back, current = one_back, current, two_back
+    return int(one_back[n])
+
+
+# Bit-parallel (Myers / Hyyrö)
+
+def bitparallel_distance(a, b):
+    """
+    Computes the Levenshtein distance with Myers' bit-vector algorithm in
+    Hyyrö's formulation. The shorter sequence becomes the pattern: each of
+    its symbols gets a match bitmask, and one column of the DP table is
+    encoded as vertical +1/-1 delta bit-vectors that are updated with a
+    fixed number of word operations per symbol of the longer sequence.
+
+    Python integers are arbitrary precision, so patterns longer than 64
+    grams are processed as multi-word blocks without extra bookkeeping.
+    """
+    a = a.tolist() if isinstance(a, np.ndarray) else list(a)
+    b = b.tolist() if isinstance(b, np.ndarray) else list(b)
+    if len(a) > len(b):
+        a, b = b, a
+    m = len(a)
+    if m == 0:
+        return len(b)
+
+    peq = {}
+    for i, symbol in enumerate(a):
+        peq[symbol] = peq.get(symbol, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn = full, 0
+    score = m
+    for symbol in b:
+        eq = peq.get(symbol, 0)
+        xv = eq | vn
+        xh = ((((eq & vp) + vp) & full) ^ vp) | eq
+        hp = vn | (~(xh | vp) & full)
+        hn = vp & xh
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        vp = hn | (~(xv | hp) & full)
+        vn = hp & xv
+    return score
+
+
+# Common prefix/suffix trimming
+
+def trim_common_affixes(a, b):
+    """
+    Strips the longest common prefix and suffix of two integer arrays.
+    Shared affixes never contribute to the Levenshtein distance, so the
+    distance of the trimmed pair equals that of the original pair.
+    """
+    a = np.asarray(a, dtype=np.int32)
+    b = np.asarray(b, dtype=np.int32)
+    shortest = min(len(a), len(b))
+    differs = a[:shortest] != b[:shortest]
+    prefix = int(np.argmax(differs)) if differs.any() else shortest
+    a, b = a[prefix:], b[prefix:]
+    shortest -= prefix
+    differs = a[len(a) - shortest:][::-1] != b[len(b) - shortest:][::-1]
+    suffix = int(np.argmax(differs)) if differs.any() else shortest
+    return a[:len(a) - suffix], b[:len(b) - suffix]
+
+
+# Diagonal transition (Myers' O(ND) difference algorithm extended to
+# substitutions, as in Ukkonen / Landau-Vishkin)
+
+def diagonal_distance(a, b, max_d=None):
+    """
+    Computes the Levenshtein distance by tracking, for each edit count d and
+    diagonal k = j - i, the furthest row reachable with d edits and sliding
+    along runs of matching grams for free. Runs in O((len(a) + len(b)) * D)
+    for a distance D, so near-identical pairs are cheap.
+
+    Returns None as soon as the distance is known to exceed max_d.
+    """
+    a = a.tolist() if isinstance(a, np.ndarray) else list(a)
+    b = b.tolist() if isinstance(b, np.ndarray) else list(b)
+    n, m = len(a), len(b)
+    if max_d is None:
+        max_d = max(n, m)
+    target = m - n
+    if abs(target) > max_d:
+        return None
+    offset = n + 1
+    # furthest[k + offset] is the furthest row reached on diagonal k with the
+    # current edit count; -1 marks diagonals not reached. Two buffers are
+    # swapped so that only the active band of diagonals is touched per step.
+    furthest = [-1] * (n + m + 3)
+    previous = [-1] * (n + m + 3)
+
+    i = 0
+    while i < n and i < m and a[i] == b[i]:
+        i += 1
+    furthest[offset] = i
+    if target == 0 and i == n:
+        return 0
+
+    for d in range(1, max_d + 1):
+        previous, furthest = furthest, previous
+        for k in range(max(-n, -d), min(m, d) + 1):
+            i = max(previous[k + offset] + 1,        # substitution
+                    previous[k - 1 + offset],        # insertion
+                    previous[k + 1 + offset] + 1)    # deletion
+            i = min(i, n, m - k)
+            if i < max(0, -k):
+                furthest[k + offset] = -1
+                continue
+            while i < n and i + k < m and a[i] == b[i + k]:
+                i += 1
+            furthest[k + offset] = i
+            if k == target and i == n:
+                return d
+    return None
+
+
+# Backend registry
+
+def nltk_distance(a, b):
+    """
+    The original scoring path: nltk's edit_distance on the ID lists.
+    """
+    return nltk_edit_distance(list(a), list(b))
+
+
+def rapidfuzz_distance(a, b):
+    return rapidfuzz_levenshtein.distance(list(a), list(b))
+
+
+BACKENDS = {
+    "nltk": nltk_distance,
+    "dp": dp_distance,
+    "wavefront": wavefront_distance,
+    "bitparallel": bitparallel_distance,
+    "diagonal": diagonal_distance,
+}
+
+# Optional backends are only offered when their library is installed
+if NUMBA_AVAILABLE:
+    BACKENDS["numba"] = jit_distance
+if rapidfuzz_levenshtein is not None:
+    BACKENDS["rapidfuzz"] = rapidfuzz_distance
+
+# The bit-parallel kernel keeps one match mask of up to len(pattern) bits per
+# distinct gram, i.e. roughly len(pattern)**2 / 16 bytes. Above this pattern
+# length the O(n) memory wavefront is used instead.
+BITPARALLEL_MAX_PATTERN = 16384
+
+
+def diagonal_budget(len_a, len_b):
+    """
+    Largest distance for which the diagonal-transition pass is attempted
+    before falling back. Its cost grows with the square of the distance, so
+    the budget keeps a failed attempt within the cost of one full pass.
+    """
+    return max(8, int((len_a + len_b) ** 0.5) // 2)
+
+
+# Backend picked by select_backend / use_backend; None means the length
+# rule in choose_backend ("auto")
+_selection = {"backend": None, "timings": {}, "sample_pairs": 0}
+
+# Backends that are too slow to be worth timing, or that only handle
+# pairs within an edit budget
+UNTIMED_BACKENDS = ("nltk", "dp", "diagonal")
+
+
+def describe_selection(backend=None, timings=None, sample_pairs=0):
+    """
+    Backend selection in the form recorded in run metadata. backend=None
+    is the length rule in choose_backend: it is recorded as auto=True with
+    the backend the rule picks (auto_backend()).
+    """
+    return {"backend": backend or auto_backend(),
+            "auto": backend is None,
+            "timings": dict(timings or {}),
+            "sample_pairs": sample_pairs,
+            "available": list(BACKENDS)}
+
+
+def select_backend(pairs, candidates=None, sample_size=8, repeats=3, apply=True):
+    """
+    Micro-benchmarks the candidate backends (default: every backend except
+    UNTIMED_BACKENDS) on up to sample_size of the given integer sequence
+    pairs, which should come from the batch about to be scored, and makes
+    the fastest one the default for int_edit_distance (apply=False only
+    returns it). Returns the selection: backend name, best-of-repeats
+    seconds per backend and the number of pairs timed.
+    """
+    candidates = candidates or [name for name in BACKENDS if name not in UNTIMED_BACKENDS]
+    pairs = list(pairs)
+    if len(pairs) > sample_size:
+        step = len(pairs) / sample_size
+        pairs = [pairs[int(k * step)] for k in range(sample_size)]
+    timings = {}
+    results = {}
+    for name in candidates:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results[name] = [BACKENDS[name](a, b) for a, b in pairs]
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    if len({tuple(values) for values in results.values()}) > 1:
+        raise RuntimeError(f"Distance backends disagree on the sample: {results}")
+    backend = min(timings, key=timings.get)
+    if apply:
+        _selection.update(backend=backend, timings=timings, sample_pairs=len(pairs))
+    return describe_selection(backend, timings, len(pairs))
+
+
+def select_text_backend(text_pairs, sample_size=8, apply=True):
+    """
+    select_backend on the 3-gram ID arrays of up to sample_size
+    (fix_response, explanation_response) pairs spread over text_pairs, so
+    only the sample is tokenized. Without pairs the current selection is
+    returned unchanged.
+    """
+    text_pairs = list(text_pairs)
+    sample = text_pairs[::max(1, len(text_pairs) // sample_size)][:sample_size]
+    if not sample:
+        return selected_backend()
+    grams = default_cache.grams_batch(text for pair in sample for text in pair)
+    return select_backend(list(zip(grams[::2], grams[1::2])), sample_size=sample_size, apply=apply)
+
+
+def use_backend(name):
+    """
+    Makes the named backend the default for int_edit_distance; None goes
+    back to the length rule in choose_backend.
+    """
+    if name is not None and name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; available: {list(BACKENDS)}")
+    _selection.update(backend=name, timings={}, sample_pairs=0)
+
+
+def selected_backend():
+    """
+    The current backend selection, for run metadata.
+    """
+    return describe_selection(_selection["backend"], _selection["timings"], _selection["sample_pairs"])
+
+
+def use_selection(selection):
+    """
+    Makes a selection returned by select_backend or selected_backend the
+    current one (e.g. to restore the previous selection).
+    """
+    use_backend(None if selection.get("auto") else selection["backend"])
+    _selection.update(timings=dict(selection["timings"]), sample_pairs=selection["sample_pairs"])
+
+
+def auto_backend(shorter=1):
+    """
+    The backend the length rule picks for a pair whose shorter sequence has
+    `shorter` elements: rapidfuzz whenever it is installed (about 4x faster
+    than the numba kernel on the Data responses), then the compiled kernel,
+    then the pure-NumPy kernels.
+    """
+    if "rapidfuzz" in BACKENDS:
+        return "rapidfuzz"
+    if NUMBA_AVAILABLE:
+        return "numba"
+    if shorter <= BITPARALLEL_MAX_PATTERN:
+        return "bitparallel"
+    return "wavefront"
+
+
+def choose_backend(len_a, len_b):
+    """
+    Picks a distance backend: the selected one if select_backend or
+    use_backend was called, otherwise auto_backend() for the two sequence
+    lengths.
+    """
+    shorter = min(len_a, len_b)
+    if shorter == 0:
+        return "dp"
+    if _selection["backend"] is not None:
+        return _selection["backend"]
+    return auto_backend(shorter)
+
+
+def int_edit_distance(a, b, backend=None):
+    """
+    Levenshtein distance between two integer ID sequences using the named
+    backend. With backend=None the shared prefix and suffix are trimmed,
+    the diagonal-transition algorithm is tried with a small edit budget, and
+    only pairs that exceed it go to the backend chosen by choose_backend,
+    so the cost follows how different the two sequences are.
+    """
+    if backend is not None:
+        return BACKENDS[backend](a, b)
+    a, b = trim_common_affixes(a, b)
+    if min(len(a), len(b)) == 0:
+        return max(len(a), len(b))
+    distance = diagonal_distance(a, b, diagonal_budget(len(a), len(b)))
+    if distance is not None:
+        return distance
+    return BACKENDS[choose_backend(len(a), len(b))](a, b)
+
+
+# Drop-in replacement for nltk.metrics.distance.edit_distance
+
+def edit_distance(s1, s2, backend=None):
+    """
+    Levenshtein distance between two sequences of hashable items (e.g. the
+    3-gram tuples returned by to_3grams). The items are interned to integer
+    IDs and scored with an automatically selected backend; the result is
+    identical to nltk.metrics.distance.edit_distance(s1, s2) with its
+    default arguments.
+    """
+    a, b = intern_grams(s1, s2)
+    return int_edit_distance(a, b, backend)
+
+
+# Thresholded distance (Ukkonen's band with early exit)
+
+def within_distance(a, b, k):
+    """
+    Returns the exact Levenshtein distance between a and b if it is at most
+    k, otherwise None. Only the diagonal band |i - j| <= k of the DP table is
+    filled, and the scan stops as soon as every cell in a row, plus the
+    diagonals still needed to reach the final cell, exceeds k.
+    Costs O(k * len(a)) instead of O(len(a) * len(b)).
+    """
+    a = a.tolist() if isinstance(a, np.ndarray) else list(a)
+    b = b.tolist() if isinstance(b, np.ndarray) else list(b)
+    n, m = len(a), len(b)
+    k = int(k)
+    if k < 0 or abs(n - m) > k:
+        return None
+    if k >= max(n, m):
+        # The band covers the whole table, so the full kernel is cheaper
+        return int_edit_distance(a, b)
+
+    # Band slot t holds D[i][i + t - k]
+    width = 2 * k + 1
+    over = k + 1
+    previous = [over] * (width + 1)
+    for j in range(min(m, k) + 1):
+        previous[j + k] = j
+    target = m - n
+    for i in range(1, n + 1):
+        x = a[i - 1]
+        current = [over] * (width + 1)
+        best = over
+        for t in range(max(0, k - i), min(width, m - i + k + 1)):
+            j = i + t - k
+            if j == 0:
+                value = i
+            else:
+                value = previous[t] + (x != b[j - 1])
+                if previous[t + 1] + 1 < value:
+                    value = previous[t + 1] + 1
+                if t and current[t - 1] + 1 < value:
+                    value = current[t - 1] + 1
+                if value > over:
+                    value = over
+            current[t] = value
+            bound = value + abs(target - (t - k))
+            if bound < best:
+                best = bound
+        if best > k:
+            return None
+        previous = current
+    result = previous[target + k]
+    return result if result <= k else None
+
+
+def distance_budget(cutoff, length):
+    """
+    Largest integer distance k with k / length <= cutoff, the test applied
+    to normalized distances, for one length or an array of lengths.
+    cutoff * length alone can land just below an integer (0.29 * 100 is
+    28.999...) and drop the pairs exactly at the cutoff.
+    """
+    length = np.asarray(length, dtype=np.int64)
+    divisor = np.maximum(length, 1)
+    budget = np.floor(cutoff * length + 1e-9).astype(np.int64)
+    budget += (budget + 1) / divisor <= cutoff
+    budget -= (budget > 0) & (budget / divisor > cutoff)
+    return budget if budget.ndim else int(budget)
+
+
+def within_normalized_distance(fix_response, explanation_response, cutoff=0.2, cache=None):
+    """
+    Screens a response pair against a cutoff on the normalized "3g edit
+    distance" used by the experiment scripts (3-gram edit distance divided
+    by the longer response's character count). Returns the normalized
+    distance when it is at most the cutoff, otherwise None.
+    """
+    cache = cache or default_cache
+    maximum_length = max(len(fix_response), len(explanation_response))
+    if maximum_length == 0:
+        return 0.0
+    a, b = cache.grams(fix_response, 3), cache.grams(explanation_response, 3)
+    distance = within_distance(a, b, distance_budget(cutoff, maximum_length))
+    if distance is None or distance / maximum_length > cutoff:
+        return None
+    return distance / maximum_length
+
+
+# Multi-order n-gram distances from one tokenization pass
+
+def gram_distances(a, b, orders=(1, 2, 3, 4, 5), cache=None):
+    """
+    Edit distances between the n-gram sequences of two responses for
+    several n at once. Each text is tokenized a single time (and not at all
+    if it is already in the token cache); each order's grams are derived
+    from the cached token ID arrays. Returns a dict mapping order to raw
+    distance; gram_distances(a, b)[3] equals
+    edit_distance(to_3grams(a), to_3grams(b)).
+    """
+    cache = cache or default_cache
+    return {order: int_edit_distance(cache.grams(a, order), cache.grams(b, order))
+            for order in orders}
+
+
+def gram_distance_columns(fix_response, explanation_response, orders=(1, 2, 4, 5), cache=None):
+    """
+    Result columns "<n>g edit distance" for the given orders, normalized by
+    the longer response's character count like the "3g edit distance"
+    column of the experiment scripts. Returns an empty dict for no orders
+    and 0.0 for every order when both responses are empty.
+    """
+    if not orders:
+        return {}
+    maximum_length = max(len(fix_response), len(explanation_response))
+    if maximum_length == 0:
+        return {f"{order}g edit distance": 0.0 for order in orders}
+    distances = gram_distances(fix_response, explanation_response, orders, cache)
+    return {f"{order}g edit distance": distance / maximum_length
+            for order, distance in distances.items()}
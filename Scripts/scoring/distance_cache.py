@@ -0,0 +1,198 @@
+"""
+Persistent cache of metric values per response pair.
+
+Values are stored in SQLite under (sha256(fix_response),
+sha256(explanation_response), metric name, metric version, tokenizer), so
+regenerating results or figures from unchanged responses reads the
+distances back instead of recomputing them, and values computed with the
+nltk and regex tokenizers are never served for each other. Bumping a
+metric's entry in METRIC_VERSIONS makes all its old values misses;
+purge_stale() deletes them.
+"""
+
+import os
+import sqlite3
+
+from .cache import text_digest
+from .ngrams import current_tokenizer
+
+
+# Bump a metric's version whenever its definition changes
+METRIC_VERSIONS = {
+    "3g edit distance": 1,
+    **{f"{order}g edit distance": 1 for order in (1, 2, 4, 5)},
+    "bpe 1g edit distance": 1,
+    "bpe 3g edit distance": 1,
+    "3g chunked edit distance": 1,
+    # Columns of profile.profile_columns
+    "3g edit distance (max grams)": 1,
+    "3g edit distance (sum grams)": 1,
+    "3g edit distance (alignment)": 1,
+    "3g raw edit distance": 1,
+    "fix chars": 1,
+    "explanation chars": 1,
+    "fix 3grams": 1,
+    "explanation 3grams": 1,
+    "3g alignment length": 1,
+}
+
+DEFAULT_PATH = os.environ.get("SCORING_DISTANCE_CACHE", "distance-cache.sqlite")
+
+
+def metric_version(metric):
+    return METRIC_VERSIONS.get(metric, 1)
+
+
+class DistanceCache:
+    """
+    SQLite-backed memo of metric values keyed by the digests of both
+    responses, the metric name and version and the current tokenizer.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # The older "distances" table had no tokenizer column; its values
+        # are ignored and dropped by purge_stale()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metric_values ("
+            " fix TEXT, explanation TEXT, metric TEXT, version INTEGER, tokenizer TEXT, value REAL,"
+            " PRIMARY KEY (fix, explanation, metric, version, tokenizer)) WITHOUT ROWID")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, pairs, metric):
+        """
+        Cached values of metric for (fix_response, explanation_response)
+        pairs, as a list with None for the misses.
+        """
+        version = metric_version(metric)
+        tokenizer = current_tokenizer()
+        values = []
+        for fix_response, explanation_response in pairs:
+            row = self.connection.execute(
+                "SELECT value FROM metric_values WHERE fix = ? AND explanation = ?"
+                " AND metric = ? AND version = ? AND tokenizer = ?",
+                (text_digest(fix_response), text_digest(explanation_response), metric, version, tokenizer),
+            ).fetchone()
+            values.append(row[0] if row else None)
+        found = sum(value is not None for value in values)
+        self.hits += found
+        self.misses += len(values) - found
+        return values
+
+    def put_many(self, rows, metric):
+        """
+        Stores (fix_response, explanation_response, value) rows for metric.
+        """
+        version = metric_version(metric)
+        tokenizer = current_tokenizer()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO metric_values VALUES (?, ?, ?, ?, ?, ?)",
+            [(text_digest(fix_response), text_digest(explanation_response), metric, version, tokenizer,
+              float(value))
+             for fix_response, explanation_response, value in rows])
+        self.connection.commit()
+
+    def get_metrics(self, fix_response, explanation_response, metrics):
+        """
+        Cached values of several metrics for one response pair, as a dict
+        with None for the misses, from a single query.
+        """
+        tokenizer = current_tokenizer()
+        keys = [(metric, metric_version(metric)) for metric in metrics]
+        placeholders = ", ".join("(?, ?)" for _ in keys)
+        rows = self.connection.execute(
+            "SELECT metric, value FROM metric_values WHERE fix = ? AND explanation = ? AND tokenizer = ?"
+            f" AND (metric, version) IN (VALUES {placeholders})",
+            (text_digest(fix_response), text_digest(explanation_response), tokenizer,
+             *[item for key in keys for item in key])).fetchall()
+        found = dict(rows)
+        values = {metric: found.get(metric) for metric in metrics}
+        hits = sum(value is not None for value in values.values())
+        self.hits += hits
+        self.misses += len(values) - hits
+        return values
+
+    def put_metrics(self, fix_response, explanation_response, values):
+        """
+        Stores a dict of metric -> value for one response pair in a single
+        transaction.
+        """
+        fix, explanation = text_digest(fix_response), text_digest(explanation_response)
+        tokenizer = current_tokenizer()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO metric_values VALUES (?, ?, ?, ?, ?, ?)",
+            [(fix, explanation, metric, metric_version(metric), tokenizer, float(value))
+             for metric, value in values.items()])
+        self.connection.commit()
+
+    def get(self, fix_response, explanation_response, metric):
+        return self.get_many([(fix_response, explanation_response)], metric)[0]
+
+    def put(self, fix_response, explanation_response, metric, value):
+        self.put_many([(fix_response, explanation_response, value)], metric)
+
+    def lookup(self, fix_response, explanation_response, metric, compute):
+        """
+        The cached value of metric for the pair, or compute() stored in the
+        cache if there is none.
+        """
+        value = self.get(fix_response, explanation_response, metric)
+        if value is None:
+            value = compute()
+            self.put(fix_response, explanation_response, metric, value)
+        return value
+
+    def purge_stale(self):
+        """
+        Deletes values stored under an older version of their metric (and
+        the table of values without a tokenizer) and returns how many were
+        removed.
+        """
+        removed = 0
+        for metric, version in METRIC_VERSIONS.items():
+            removed += self.connection.execute(
+                "DELETE FROM metric_values WHERE metric = ? AND version != ?", (metric, version)).rowcount
+        legacy = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'distances'").fetchone()
+        if legacy:
+            removed += self.connection.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+            self.connection.execute("DROP TABLE distances")
+        self.connection.commit()
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self.connection.execute("SELECT COUNT(*) FROM metric_values").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+_default_distance_cache = None
+
+
+def default_distance_cache():
+    """
+    The process-wide DistanceCache at DEFAULT_PATH, opened on first use.
+    """
+    global _default_distance_cache
+    if _default_distance_cache is None:
+        _default_distance_cache = DistanceCache()
+    return _default_distance_cache
+
+
+def cached_distance(fix_response, explanation_response, metric, compute):
+    """
+    Looks the metric value of a response pair up in the default distance
+    cache, calling compute() and storing its result on a miss.
+    """
+    return default_distance_cache().lookup(fix_response, explanation_response, metric, compute)
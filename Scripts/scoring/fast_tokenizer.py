@@ -0,0 +1,321 @@
+"""
+Regex re-implementation of nltk.word_tokenize for the scoring pipeline.
+
+nltk.word_tokenize splits a text into sentences with the Punkt model and
+then runs NLTKWordTokenizer (an extended Treebank tokenizer) on every
+sentence. Here the Punkt decisions for lower-cased responses are
+reproduced from the parameters of the English punkt_tab model that can
+affect them (abbreviations, collocations and the few lower-case sentence
+starters of its orthographic context), and the Treebank regex chain runs
+once over a whole batch of texts whose sentences are joined by separator
+characters instead of once per sentence. No punkt resource is needed at
+runtime.
+
+The regexes follow nltk 3.9 / 3.10 (nltk/tokenize/destructive.py and
+nltk/tokenize/punkt.py); scoring.benchmark has the parity check against
+nltk.word_tokenize. With nltk 3.10.3 and the real punkt_tab English model,
+compare_tokenizers finds no differences on the 9,804 responses in Data
+(numbered steps such as "1. check ..." included), at about 2.5x the
+throughput of nltk.word_tokenize.
+"""
+
+import re
+
+
+# Sentence separator: never part of a token, never whitespace
+SENTENCE = "\x00"
+_SEP = "\x00"
+
+
+# Punkt sentence boundaries
+
+# Parameters of the English punkt_tab model (tokenizers/punkt_tab/english)
+# that can affect lower-cased text.
+
+# abbrev_types.txt (one entry containing a space can never match a token
+# and is left out). A period after one of these is not a sentence break.
+ABBREVIATIONS = frozenset([
+    "a.a", "a.c", "a.d", "a.g", "a.h", "a.m", "a.m.e", "a.s", "a.t", "adm",
+    "ala", "ariz", "aug", "ave", "b.f", "b.v", "bros", "c", "c.i.t", "c.o.m.b",
+    "c.v", "calif", "chg", "cie", "co", "col", "colo", "conn", "corp", "cos",
+    "ct", "d", "d.c", "d.h", "d.w", "dec", "dr", "e", "e.f", "e.h", "e.l",
+    "e.m", "f", "f.g", "f.j", "feb", "fla", "fri", "ft", "g", "g.d", "g.f",
+    "g.k", "ga", "gen", "h", "h.c", "h.f", "h.m", "i.m.s", "ill", "inc", "j.b",
+    "j.c", "j.j", "j.k", "j.p", "j.r", "jan", "jr", "k", "kan", "ky", "l",
+    "l.a", "l.f", "l.p", "lt", "ltd", "m", "m.b.a", "m.d.c", "m.j", "maj",
+    "messrs", "mg", "mich", "minn", "mr", "mrs", "ms", "n", "n.c", "n.d",
+    "n.h", "n.j", "n.m", "n.v", "n.y", "nev", "nov", "oct", "ok", "okla",
+    "ore", "p", "p.a.m", "p.m", "pa", "ph.d", "prof", "r", "r.a", "r.h", "r.i",
+    "r.j", "r.k", "r.t", "rep", "reps", "s", "s.a", "s.a.y", "s.c", "s.g",
+    "s.p.a", "s.s", "sen", "sep", "sept", "sr", "st", "sw", "t", "t.j", "tenn",
+    "tues", "u.k", "u.n", "u.s", "u.s.a", "u.s.s.r", "v", "va", "vs", "vt",
+    "w", "w.c", "w.r", "w.va", "w.w", "wash", "wed", "wis", "yr",
+])
+
+# collocations.tab: (word before the period, word after it) pairs whose
+# period is never a sentence break
+COLLOCATIONS = frozenset([
+    ("##number##", "abreast"), ("##number##", "aes"), ("##number##", "business"),
+    ("##number##", "cbot"), ("##number##", "colgate"), ("##number##", "commodities"),
+    ("##number##", "cooper"), ("##number##", "corrections"), ("##number##", "credit"),
+    ("##number##", "dividend"), ("##number##", "financing"), ("##number##", "genentech"),
+    ("##number##", "henley"), ("##number##", "insider"), ("##number##", "international"),
+    ("##number##", "leisure"), ("##number##", "letters"), ("##number##", "notable"),
+    ("##number##", "pay-fone"), ("##number##", "pegasus"), ("##number##", "pepper"),
+    ("##number##", "review"), ("##number##", "rj"), ("##number##", "wedgestone"),
+    ("##number##", "who"), ("##number##", "zimmer"), ("b", "edelman"), ("b", "levine"),
+    ("b", "smith"), ("b", "stewart"), ("b", "wigton"), ("i", "magnin"), ("i", "toussie"),
+    ("j", "aron"), ("j", "fialka"), ("j", "walter"), ("o", "ludcke"),
+])
+
+# Of the words in ortho_context.tab, those seen lower-case at a sentence
+# start and never capitalized. Before any other lower-case word the
+# orthographic heuristic rules out a sentence start, so the period after
+# a number or an initial is not a break; before these it stays one.
+LOWER_CASE_STARTERS = frozenset(["administrators", "b-week", "r-revised", "z-holiday"])
+
+# A sentence-end character followed by other punctuation or by whitespace
+# and the next token (Punkt's period context)
+_END_CONTEXT = re.compile(
+    r"[.?!](?=(?:[)\";}\]*:@'({\[‘’“”\xab\xbb?!])|\s+(\S+))")
+# Punkt's word tokenizer (PunktLanguageVars._word_tokenize_fmt)
+_NON_WORD = r"(?:[)\";}\]\*:@\'\({\[‘’“”\xab\xbb\?!])"
+_MULTI_CHAR = r"(?:\-{2,}|\.{2,}|(?:\.\s){2,}\.)"
+_PUNKT_WORD = re.compile(
+    rf"{_MULTI_CHAR}"
+    rf"|(?=[^\(\"\`{{\[:;&\#\*@\)}}\]\-,])\S+?"
+    rf"(?=\s|$|{_NON_WORD}|{_MULTI_CHAR}|,(?=$|\s|{_NON_WORD}|{_MULTI_CHAR}))"
+    r"|\S")
+_NUMERIC = re.compile(r"^-?[\.,]?\d[\d,\.-]*\.?$")
+_INITIAL = re.compile(r"[^\W\d]\.$")
+_ELLIPSIS = re.compile(r"\.\.+$")
+_PUNKT_WHITESPACE = " \t\n\r\x0b\x0c"
+_WHITESPACE = re.compile(r"\s")
+_REALIGN = re.compile(r'["\')\]}‘’“”\xab\xbb]+?(?:\s+|(?=--)|$)')
+
+
+def _type(token, sentbreak=False):
+    """
+    Punkt's type of a token: numbers become "##number##"; with sentbreak
+    the final period is removed (type_no_period / type_no_sentperiod).
+    """
+    typ = _NUMERIC.sub("##number##", token)
+    if sentbreak and len(typ) > 1 and typ[-1] == ".":
+        return typ[:-1]
+    return typ
+
+
+def _is_sentence_break(text, match):
+    """
+    Punkt's decision for one candidate: the word before it, the candidate
+    and what follows are tokenized and annotated like
+    PunktSentenceTokenizer.text_contains_sentbreak does, with the model
+    parameters above. Lower-cased text never has a capitalized next word,
+    so the heuristics that need one cannot fire.
+    """
+    if text[match.start()] != ".":
+        return True
+    word_start = max(text.rfind(space, 0, match.start()) for space in _PUNKT_WHITESPACE) + 1
+    after_end = match.end(1) if match.group(1) is not None else match.end() + 1
+    tokens = _PUNKT_WORD.findall(text, word_start, after_end)
+
+    # First pass: sentence-end characters and periods after non-abbreviations
+    breaks = []
+    for token in tokens:
+        if token in (".", "?", "!"):
+            breaks.append(True)
+        elif _ELLIPSIS.match(token) or not token.endswith(".") or token.endswith(".."):
+            breaks.append(False)
+        else:
+            stem = token[:-1]
+            breaks.append(not (stem in ABBREVIATIONS or stem.split("-")[-1] in ABBREVIATIONS))
+
+    # Second pass: collocations, and numbers / initials before a word that
+    # cannot start a sentence
+    for i, (token, following) in enumerate(zip(tokens, tokens[1:])):
+        if not token.endswith("."):
+            continue
+        typ = _type(token, sentbreak=True)
+        next_typ = _type(following, breaks[i + 1])
+        if (typ, next_typ) in COLLOCATIONS:
+            breaks[i] = False
+        elif _INITIAL.match(token) or typ == "##number##":
+            if following in (";", ":", ",", ".", "!", "?") or (
+                    following[0].islower() and next_typ not in LOWER_CASE_STARTERS):
+                breaks[i] = False
+    # A break on the last token does not count (Punkt cannot see past it)
+    return any(breaks[:-1])
+
+
+def split_sentences(text):
+    """
+    Splits a lower-cased response into sentences like the English Punkt
+    model used by nltk.sent_tokenize.
+    """
+    sentences = []
+    start = 0
+    candidates = list(_END_CONTEXT.finditer(text))
+    for match, following in zip(candidates, candidates[1:] + [None]):
+        # Of several candidates inside one whitespace-free run (e.g. "!!!")
+        # Punkt only considers the last, unless a candidate has no word
+        # before it (e.g. '?"quoted."' at the start of a text)
+        if (following is not None and not _WHITESPACE.search(text, match.end(), following.start() + 1)
+                and match.start() > 0 and text[match.start() - 1] not in _PUNKT_WHITESPACE):
+            continue
+        if not _is_sentence_break(text, match):
+            continue
+        end = match.end()
+        next_start = match.start(1) if match.group(1) is not None else end
+        # Closing quotes / brackets right after the break stay with the sentence
+        aligned = _REALIGN.match(text, next_start)
+        if aligned:
+            end = next_start + len(aligned.group().rstrip())
+            next_start = aligned.end()
+        if text[start:end]:
+            sentences.append(text[start:end])
+        start = next_start
+    last = text[start:len(text.rstrip())]
+    if last:
+        sentences.append(last)
+    return sentences
+
+
+# NLTKWordTokenizer regex chain, with ^ / $ anchors and negated character
+# classes adapted so that the separator characters act as string edges
+
+_BEGIN = rf"(?:^|(?<=[{_SEP}]))"
+_END = rf"(?=[{_SEP}]|$)"
+
+_STARTING_QUOTES = [
+    (re.compile("([«“‘„]|[`]+)"), r" \1 "),
+    (re.compile(_BEGIN + r"\""), r"``"),
+    (re.compile(r"(``)"), r" \1 "),
+    (re.compile(r"([ \(\[{<])(\"|\'{2})"), r"\1 `` "),
+    (re.compile(r"(?i)(?<!\w)(\')(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)"), r"\1 "),
+]
+
+_PUNCTUATION = [
+    (re.compile(rf"([^\.{_SEP}])(\.)([\]\)}}>\"\'»”’ ]*)\s*{_END}"), r"\1 \2 \3 "),
+    (re.compile(rf"([:,])([^\d{_SEP}])"), r" \1 \2"),
+    (re.compile(rf"([:,]){_END}"), r" \1 "),
+    (re.compile("\\.{2,}|[;@#$%&\u2012-\u2015]"), r" \g<0> "),
+    (re.compile(rf"([^\.{_SEP}])(\.)([\]\)}}>\"\']*)\s*{_END}"), r"\1 \2\3 "),
+    (re.compile(r"[?!]"), r" \g<0> "),
+    (re.compile(rf"([^'{_SEP}])' "), r"\1 ' "),
+    (re.compile(r"[*\]\[\(\)\{\}\<\>]"), r" \g<0> "),
+    (re.compile(r"--"), r" -- "),
+]
+
+_SEPARATOR_PADDING = (re.compile(rf"([{_SEP}])"), r" \1 ")
+
+_ENDING_QUOTES = [
+    (re.compile("([»”’])"), r" \1 "),
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r"\s+"), " "),
+    (re.compile(rf"([^' {_SEP}])('[sS]|'[mM]|'[dD]|') "), r"\1 \2 "),
+    (re.compile(rf"([^' {_SEP}])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r"\1 \2 "),
+]
+
+# MacIntyre contractions, applied in one pass instead of one regex each
+_CONTRACTIONS = re.compile(
+    r"(?i)\b(?:(can)(not)|(d)('ye)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me)|(more)('n))\b"
+    r"|\b(wan)(na)(?=\s)"
+    r"| ('t)(is)\b"
+    r"| ('t)(was)\b"
+)
+
+
+def _split_contraction(match):
+    first, second = (group for group in match.groups() if group is not None)
+    return f" {first} {second} "
+
+
+def _treebank(text):
+    for regexp, substitution in _STARTING_QUOTES:
+        text = regexp.sub(substitution, text)
+    for regexp, substitution in _PUNCTUATION:
+        text = regexp.sub(substitution, text)
+    regexp, substitution = _SEPARATOR_PADDING
+    text = " " + regexp.sub(substitution, text) + " "
+    for regexp, substitution in _ENDING_QUOTES:
+        text = regexp.sub(substitution, text)
+    text = _CONTRACTIONS.sub(_split_contraction, text)
+    return text.split()
+
+
+# Most sentences contain no quote or apostrophe characters. For those the
+# quote, apostrophe and whitespace rules of the chain are no-ops and the
+# remaining single-character paddings do not interact, so a much shorter
+# chain gives the same tokens.
+
+_QUOTED = re.compile("[\"'`«»“”‘’„]")
+
+_PLAIN_CHAIN = [
+    _PUNCTUATION[0],
+    _PUNCTUATION[1],
+    _PUNCTUATION[2],
+    (re.compile("\\.{2,}|--|[;@#$%&\u2012-\u2015?!*\\]\\[(){}<>]"), r" \g<0> "),
+    _SEPARATOR_PADDING,
+]
+
+_PLAIN_CONTRACTIONS = re.compile(
+    r"(?i)\b(?:(can)(not)|(gim)(me)|(gon)(na)|(got)(ta)|(lem)(me))\b|\b(wan)(na)(?=\s)"
+)
+
+
+def _treebank_plain(text):
+    for regexp, substitution in _PLAIN_CHAIN:
+        text = regexp.sub(substitution, text)
+    text = _PLAIN_CONTRACTIONS.sub(_split_contraction, text + " ")
+    return text.split()
+
+
+def _tokenize_sentences(sentences, chain):
+    """
+    Runs a regex chain once over all sentences joined by the separator and
+    returns one token list per sentence.
+    """
+    if not sentences:
+        return []
+    groups = [[]]
+    for token in chain(SENTENCE.join(sentences)):
+        if token == SENTENCE:
+            groups.append([])
+        else:
+            groups[-1].append(token)
+    return groups
+
+
+# Entry points
+
+def fast_tokenize_batch(texts):
+    """
+    Tokenizes a batch of texts with one pass of each regex chain over all
+    of their sentences and returns one token list per text, matching
+    [nltk.word_tokenize(text) for text in texts].
+    """
+    sentences = [split_sentences(text) for text in texts]
+    flat = [sentence for text_sentences in sentences for sentence in text_sentences]
+    quoted = [bool(_QUOTED.search(sentence)) for sentence in flat]
+    plain_tokens = iter(_tokenize_sentences(
+        [sentence for sentence, q in zip(flat, quoted) if not q], _treebank_plain))
+    quoted_tokens = iter(_tokenize_sentences(
+        [sentence for sentence, q in zip(flat, quoted) if q], _treebank))
+
+    batches = []
+    position = 0
+    for text_sentences in sentences:
+        tokens = []
+        for q in quoted[position:position + len(text_sentences)]:
+            tokens.extend(next(quoted_tokens) if q else next(plain_tokens))
+        position += len(text_sentences)
+        batches.append(tokens)
+    return batches
+
+
+def fast_word_tokenize(text):
+    """
+    Regex equivalent of nltk.word_tokenize(text) for a single text.
+    """
+    return fast_tokenize_batch([text])[0]
@@ -0,0 +1,154 @@
+"""
+Lower-bound filter cascade in front of the exact distance engine.
+
+For threshold queries ("which pairs are within distance k?") most pairs can
+be rejected without any DP:
+
+- length: the edit distance is at least |len(a) - len(b)|;
+- counts: one edit changes the gram count vector by at most 2 in L1 norm,
+  so the distance is at least L1(count(a) - count(b)) / 2.
+
+Both bounds are computed for a whole batch of candidate pairs with a few
+NumPy operations; only the surviving pairs reach exact scoring.
+"""
+
+import time
+
+import numpy as np
+
+from .cache import default_cache
+from .distance import distance_budget, int_edit_distance, within_distance
+
+
+# Vectorized lower bounds
+
+def length_bounds(lengths_a, lengths_b):
+    return np.abs(np.asarray(lengths_a, dtype=np.int64) - np.asarray(lengths_b, dtype=np.int64))
+
+
+def count_bounds(arrays_a, arrays_b):
+    """
+    ceil(L1(count(a) - count(b)) / 2) for every pair (arrays_a[p],
+    arrays_b[p]) of gram ID arrays, computed for all pairs at once.
+    """
+    n_pairs = len(arrays_a)
+    if n_pairs == 0:
+        return np.zeros(0, dtype=np.int64)
+    lengths_a = np.array([len(a) for a in arrays_a], dtype=np.int64)
+    lengths_b = np.array([len(b) for b in arrays_b], dtype=np.int64)
+    ids = np.concatenate([np.concatenate(arrays_a), np.concatenate(arrays_b)]).astype(np.int64)
+    if len(ids) == 0:
+        return np.zeros(n_pairs, dtype=np.int64)
+    pairs = np.concatenate([np.repeat(np.arange(n_pairs), lengths_a),
+                            np.repeat(np.arange(n_pairs), lengths_b)])
+    signs = np.concatenate([np.ones(lengths_a.sum()), -np.ones(lengths_b.sum())])
+
+    # One key per (pair, gram); the signed sum per key is count_a - count_b
+    vocab_size = int(ids.max()) + 1
+    keys = pairs * vocab_size + ids
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    differences = np.abs(np.bincount(inverse.reshape(-1), weights=signs))
+    l1 = np.bincount(unique_keys // vocab_size, weights=differences, minlength=n_pairs)
+    return (l1.astype(np.int64) + 1) // 2
+
+
+# Filter cascade
+
+# The banded pure-Python DP only beats the full bit-parallel kernel when the
+# band is a small fraction of the table
+NARROW_BAND = 1 / 32
+
+
+def exact_within(a, b, k):
+    """
+    Exact distance if it is at most k, otherwise None, using the banded DP
+    for narrow bands and the full kernel otherwise.
+    """
+    if 2 * k + 1 <= NARROW_BAND * min(len(a), len(b)):
+        return within_distance(a, b, k)
+    distance = int_edit_distance(a, b)
+    return distance if distance <= k else None
+
+
+def filter_cascade(arrays_a, arrays_b, max_distances):
+    """
+    Evaluates the lower bounds for a batch of pairs against per-pair (or a
+    single) maximum distance. Returns the boolean mask of pairs that may be
+    within their maximum and the number of pairs pruned by each stage.
+    """
+    n_pairs = len(arrays_a)
+    max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.int64), (n_pairs,))
+    keep = length_bounds([len(a) for a in arrays_a], [len(b) for b in arrays_b]) <= max_distances
+    pruned_length = int(n_pairs - keep.sum())
+
+    survivors = np.flatnonzero(keep)
+    bounds = count_bounds([arrays_a[p] for p in survivors], [arrays_b[p] for p in survivors])
+    keep[survivors[bounds > max_distances[survivors]]] = False
+    pruned_counts = int(len(survivors) - keep[survivors].sum())
+    return keep, {"length": pruned_length, "counts": pruned_counts}
+
+
+def distances_within(arrays_a, arrays_b, max_distances):
+    """
+    Exact distance for every pair that is within its maximum distance and
+    None for the others, running the filter cascade first. Returns the
+    distances and a report for the batch: pairs, pruned per stage, pruning
+    rate, seconds spent, and the estimated seconds saved (pruned pairs
+    times the mean exact-scoring time of the surviving pairs).
+    """
+    start = time.perf_counter()
+    n_pairs = len(arrays_a)
+    max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.int64), (n_pairs,))
+    keep, pruned = filter_cascade(arrays_a, arrays_b, max_distances)
+    filter_seconds = time.perf_counter() - start
+
+    distances = [None] * n_pairs
+    exact_start = time.perf_counter()
+    survivors = np.flatnonzero(keep)
+    for p in survivors:
+        distances[p] = exact_within(arrays_a[p], arrays_b[p], int(max_distances[p]))
+    exact_seconds = time.perf_counter() - exact_start
+
+    total_pruned = pruned["length"] + pruned["counts"]
+    per_pair = exact_seconds / len(survivors) if len(survivors) else 0.0
+    report = {
+        "pairs": n_pairs,
+        "pruned_length": pruned["length"],
+        "pruned_counts": pruned["counts"],
+        "exact": len(survivors),
+        "pruning_rate": total_pruned / n_pairs if n_pairs else 0.0,
+        "filter_seconds": filter_seconds,
+        "exact_seconds": exact_seconds,
+        "seconds_saved": max(0.0, total_pruned * per_pair - filter_seconds),
+    }
+    return distances, report
+
+
+def pairs_within(texts, cutoff, pairs=None, batch_size=4096, cache=None):
+    """
+    Threshold query over responses: every pair (i, j) (default: all i < j)
+    whose normalized "3g edit distance" (3-gram distance divided by the
+    longer response's character count) is at most cutoff. Returns the
+    matches as (i, j, normalized distance) and one report per batch.
+    """
+    cache = cache or default_cache
+    texts = [str(text) for text in texts]
+    grams = cache.grams_batch(texts, 3)
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    if pairs is None:
+        pairs = [(i, j) for i in range(len(texts)) for j in range(i + 1, len(texts))]
+
+    matches, reports = [], []
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        longest = np.array([max(lengths[i], lengths[j]) for i, j in batch], dtype=np.int64)
+        distances, report = distances_within([grams[i] for i, _ in batch],
+                                             [grams[j] for _, j in batch],
+                                             distance_budget(cutoff, longest))
+        for (i, j), distance, maximum in zip(batch, distances, longest):
+            if distance is not None:
+                normalized = distance / maximum if maximum else 0.0
+                if normalized <= cutoff:
+                    matches.append((i, j, normalized))
+        reports.append(report)
+    return matches, reports
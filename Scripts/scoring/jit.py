@@ -0,0 +1,99 @@
+"""
+Optional Numba-compiled Levenshtein kernel over int32 gram-ID arrays.
+
+numba is not a requirement of the scripts: when it is installed the kernel
+is compiled on first use and registered as the "numba" backend, otherwise
+NUMBA_AVAILABLE is False and the pure-Python / NumPy backends are used.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def _dp_kernel(a, b):
+    """
+    Two-row Levenshtein DP over two int32 arrays (same recurrence as
+    nltk edit_distance). Written in the subset of Python that Numba
+    compiles; without Numba it still runs, just slowly.
+    """
+    n, m = len(a), len(b)
+    previous = np.arange(m + 1).astype(np.int32)
+    current = np.empty(m + 1, dtype=np.int32)
+    for i in range(1, n + 1):
+        current[0] = i
+        x = a[i - 1]
+        for j in range(1, m + 1):
+            value = previous[j - 1] + (0 if x == b[j - 1] else 1)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            current[j] = value
+        previous, current = current, previous
+    return previous[m]
+
+
+if NUMBA_AVAILABLE:
+    _compiled_kernel = numba.njit(cache=True, nogil=True)(_dp_kernel)
+else:
+    _compiled_kernel = None
+
+
+def jit_distance(a, b):
+    """
+    Levenshtein distance between two integer sequences with the compiled
+    kernel (the pure-Python kernel if numba is missing).
+    """
+    a = np.ascontiguousarray(a, dtype=np.int32)
+    b = np.ascontiguousarray(b, dtype=np.int32)
+    kernel = _compiled_kernel if NUMBA_AVAILABLE else _dp_kernel
+    return int(kernel(a, b))
+
+
+def _profile_kernel(a, b):
+    """
+    Levenshtein DP that also minimizes the number of insertions and
+    deletions among the optimal alignments: every cell holds
+    distance * scale + indels with scale larger than any indel count.
+    """
+    n, m = len(a), len(b)
+    scale = n + m + 1
+    previous = np.arange(m + 1).astype(np.int64) * (scale + 1)
+    current = np.empty(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        current[0] = i * (scale + 1)
+        x = a[i - 1]
+        for j in range(1, m + 1):
+            value = previous[j - 1] + (0 if x == b[j - 1] else scale)
+            if previous[j] + scale + 1 < value:
+                value = previous[j] + scale + 1
+            if current[j - 1] + scale + 1 < value:
+                value = current[j - 1] + scale + 1
+            current[j] = value
+        previous, current = current, previous
+    return previous[m]
+
+
+if NUMBA_AVAILABLE:
+    _compiled_profile_kernel = numba.njit(cache=True, nogil=True)(_profile_kernel)
+else:
+    _compiled_profile_kernel = None
+
+
+def jit_profile(a, b):
+    """
+    (distance, indels) of an optimal alignment with the fewest insertions
+    and deletions, from the compiled kernel. Only used when numba is
+    installed; scoring.profile has the NumPy version.
+    """
+    a = np.ascontiguousarray(a, dtype=np.int32)
+    b = np.ascontiguousarray(b, dtype=np.int32)
+    value = int(_compiled_profile_kernel(a, b))
+    scale = len(a) + len(b) + 1
+    return value // scale, value % scale
@@ -0,0 +1,118 @@
+"""
+All-pairs 3-gram edit distances between the responses of one domain (e.g.
+the 300 Car fix_responses of a model).
+
+Only the upper triangle is computed. It is cut into square tiles that are
+scored by a process pool, and every worker writes its tile (and the
+mirrored lower-triangle tile) straight into a float32 np.memmap, so the
+full matrix never has to be held in memory.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .cache import default_cache
+from .distance import int_edit_distance
+
+
+# Worker state, set once per process by _init_worker
+
+_grams = None
+_lengths = None
+_out = None
+
+
+def _init_worker(grams, lengths, path, n):
+    global _grams, _lengths, _out
+    _grams = grams
+    _lengths = lengths
+    _out = np.memmap(path, dtype=np.float32, mode="r+", shape=(n, n))
+
+
+def _score_tile(tile):
+    (i0, i1), (j0, j1) = tile
+    block = np.zeros((i1 - i0, j1 - j0), dtype=np.float32)
+    for i in range(i0, i1):
+        for j in range(max(j0, i + 1), j1):
+            distance = int_edit_distance(_grams[i], _grams[j])
+            if _lengths is not None:
+                longest = max(_lengths[i], _lengths[j])
+                distance = distance / longest if longest else 0.0
+            block[i - i0, j - j0] = distance
+    if i0 == j0:
+        # Diagonal tile: mirror inside the tile
+        _out[i0:i1, j0:j1] = block + block.T
+    else:
+        _out[i0:i1, j0:j1] = block
+        _out[j0:j1, i0:i1] = block.T
+    _out.flush()
+    return i1 - i0, j1 - j0
+
+
+# Tiling
+
+def triangle_tiles(n, tile_size):
+    """
+    Square tiles ((i0, i1), (j0, j1)) covering the upper triangle of an
+    n x n matrix, diagonal tiles included.
+    """
+    bounds = [(start, min(start + tile_size, n)) for start in range(0, n, tile_size)]
+    return [(rows, columns) for k, rows in enumerate(bounds) for columns in bounds[k:]]
+
+
+def _tile_cost(tile, gram_lengths):
+    (i0, i1), (j0, j1) = tile
+    return float(np.sum(gram_lengths[i0:i1])) * float(np.sum(gram_lengths[j0:j1]))
+
+
+# Entry Points
+
+def pairwise_distances(texts, path, normalize=True, workers=None, tile_size=32, cache=None):
+    """
+    Computes the 3-gram edit distance between every pair of texts and
+    writes the symmetric n x n float32 matrix to a memmap file at path,
+    which is returned opened read-only. With normalize=True the distances
+    are divided by the longer text's character count, as the "3g edit
+    distance" column of the experiment scripts is.
+
+    Texts are tokenized once; tiles are handed out most expensive first so
+    the pool finishes evenly.
+    """
+    cache = cache or default_cache
+    texts = [str(text) for text in texts]
+    n = len(texts)
+    grams = cache.grams_batch(texts, 3)
+    lengths = np.array([len(text) for text in texts]) if normalize else None
+
+    out = np.memmap(path, dtype=np.float32, mode="w+", shape=(n, n))
+    out[:] = 0.0
+    out.flush()
+    del out
+
+    gram_lengths = np.array([len(g) for g in grams], dtype=np.float64)
+    tiles = sorted(triangle_tiles(n, tile_size),
+                   key=lambda tile: _tile_cost(tile, gram_lengths), reverse=True)
+    workers = workers or os.cpu_count() or 1
+    init_args = (grams, lengths, path, n)
+    if workers == 1 or len(tiles) < 2:
+        _init_worker(*init_args)
+        for tile in tiles:
+            _score_tile(tile)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=init_args) as pool:
+            list(pool.map(_score_tile, tiles))
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(n, n))
+
+
+def domain_distances(df, path, column="fix_response", **kwargs):
+    """
+    All-pairs distance matrix over one response column of an experiment
+    DataFrame (rows without a response are skipped). Returns the matrix and
+    the DataFrame index of each of its rows.
+    """
+    responses = df[column].dropna()
+    responses = responses[responses.map(lambda value: isinstance(value, str))]
+    return pairwise_distances(responses.tolist(), path, **kwargs), responses.index
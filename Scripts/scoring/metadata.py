@@ -0,0 +1,48 @@
+import json
+import os
+import platform
+from datetime import datetime, timezone
+
+import nltk
+import numpy as np
+
+from .distance import selected_backend
+from .ngrams import current_tokenizer
+
+
+# Run metadata written next to the results, so a scored file records how
+# its distances were computed
+
+def run_metadata(**extra):
+    """
+    Tokenizer, distance backend selection (with its benchmark timings) and
+    library versions of the current process, plus any extra fields.
+    """
+    metadata = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "tokenizer": current_tokenizer(),
+        "distance_backend": selected_backend(),
+        "python": platform.python_version(),
+        "nltk": nltk.__version__,
+        "numpy": np.__version__,
+    }
+    metadata.update(extra)
+    return metadata
+
+
+def metadata_file(save_file):
+    """
+    Side-file name used for the run metadata of a results file.
+    """
+    root, _ = os.path.splitext(save_file)
+    return f"{root}-metadata.json"
+
+
+def write_run_metadata(save_file, **extra):
+    """
+    Writes run_metadata() next to save_file and returns the path written.
+    """
+    path = metadata_file(save_file)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(run_metadata(**extra), handle, indent=2)
+    return path
@@ -0,0 +1,232 @@
+"""
+MinHash signatures and a banded LSH index over the 3-gram shingles of the
+responses, for near-duplicate queries across models and runs where exact
+edit distance over every cross pair is too expensive.
+
+Signatures are written next to the results they come from
+("<results>-minhash.npz"), so an index over all saved runs is built by
+loading those files instead of re-tokenizing every response.
+
+Run from the Scripts directory with:
+    python -m scoring.minhash ../Data/*.xlsx --threshold 0.8
+"""
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from .cache import text_digest
+from .ngrams import to_3grams
+
+
+NUM_PERM = 128
+BANDS = 32
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+# MinHash signatures
+
+def _permutations(num_perm, seed=1):
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+_PERMUTATIONS = {NUM_PERM: _permutations(NUM_PERM)}
+
+
+def shingle_hashes(text):
+    """
+    32-bit hashes of the distinct 3-grams of a text, as produced by
+    to_3grams. blake2b keeps them stable across processes and sessions.
+    """
+    shingles = {" ".join(gram) for gram in to_3grams(text)}
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                     for s in shingles], dtype=np.uint64)
+
+
+def minhash_signature(text, num_perm=NUM_PERM):
+    """
+    MinHash signature (num_perm uint32 values) of a text's 3-gram set. The
+    fraction of equal positions in two signatures estimates the Jaccard
+    similarity of the two shingle sets.
+    """
+    if num_perm not in _PERMUTATIONS:
+        _PERMUTATIONS[num_perm] = _permutations(num_perm)
+    a, b = _PERMUTATIONS[num_perm]
+    hashes = shingle_hashes(text)
+    if len(hashes) == 0:
+        return np.full(num_perm, _MAX_HASH, dtype=np.uint32)
+    # a, b and the hashes are below 2**32, so a * x + b fits in uint64
+    permuted = (np.outer(hashes, a) + b) % np.uint64(_MERSENNE_PRIME)
+    return (permuted & np.uint64(_MAX_HASH)).min(axis=0).astype(np.uint32)
+
+
+def estimated_jaccard(signature_a, signature_b):
+    return float(np.mean(signature_a == signature_b))
+
+
+# Signature files next to the results
+
+def signature_file(save_file):
+    """
+    Side-file name used for the MinHash signatures of a results file.
+    """
+    root, _ = os.path.splitext(save_file)
+    return f"{root}-minhash.npz"
+
+
+def load_signatures(path):
+    """
+    Returns {text digest: signature} from a signature file.
+    """
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        return dict(zip(data["digests"].tolist(), data["signatures"]))
+
+
+def write_signatures(texts, save_file, num_perm=NUM_PERM):
+    """
+    Writes the signatures of the given texts next to save_file, reusing
+    the signatures already stored there for unchanged texts. Returns the
+    signatures in the order of texts.
+    """
+    path = signature_file(save_file)
+    known = load_signatures(path)
+    digests = [text_digest(text) for text in texts]
+    signatures = []
+    for digest, text in zip(digests, texts):
+        signature = known.get(digest)
+        if signature is None or len(signature) != num_perm:
+            signature = minhash_signature(text, num_perm)
+        signatures.append(signature)
+    np.savez(path, digests=np.array(digests),
+             signatures=np.array(signatures, dtype=np.uint32).reshape(len(texts), num_perm))
+    return signatures
+
+
+# Banded LSH index
+
+class LSHIndex:
+    """
+    Banded LSH over MinHash signatures: the signature is cut into `bands`
+    bands and two items become candidates when any band matches exactly.
+    Pairs with Jaccard similarity s collide with probability
+    1 - (1 - s**rows)**bands, so queries only look at the few items that
+    share a bucket instead of the whole corpus.
+
+    Items can be added at any time; keys are any hashable label, e.g.
+    (model, sheet, row).
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def _band_keys(self, signature):
+        signature = np.asarray(signature, dtype=np.uint32)
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def add(self, key, signature):
+        if key in self.signatures:
+            return
+        self.signatures[key] = np.asarray(signature, dtype=np.uint32)
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def add_text(self, key, text):
+        self.add(key, minhash_signature(text, self.num_perm))
+
+    def candidates(self, signature):
+        found = set()
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            found.update(bucket.get(band_key, ()))
+        return found
+
+    def query(self, signature, threshold=0.8):
+        """
+        Keys whose estimated Jaccard similarity to signature is at least
+        threshold, as (key, similarity) pairs, most similar first.
+        """
+        matches = []
+        for key in self.candidates(signature):
+            similarity = estimated_jaccard(signature, self.signatures[key])
+            if similarity >= threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def query_text(self, text, threshold=0.8):
+        return self.query(minhash_signature(text, self.num_perm), threshold)
+
+    def near_duplicates(self, threshold=0.8):
+        """
+        All pairs of indexed keys with estimated Jaccard similarity of at
+        least threshold, as (key_a, key_b, similarity).
+        """
+        pairs = {}
+        for bucket in self.buckets:
+            for keys in bucket.values():
+                for i, key_a in enumerate(keys):
+                    for key_b in keys[i + 1:]:
+                        if (key_a, key_b) not in pairs:
+                            pairs[(key_a, key_b)] = estimated_jaccard(
+                                self.signatures[key_a], self.signatures[key_b])
+        return [(a, b, s) for (a, b), s in pairs.items() if s >= threshold]
+
+
+# Building an index from saved results
+
+def _result_frames(path):
+    if path.endswith(".csv"):
+        return {"": pd.read_csv(path)}
+    return pd.read_excel(path, sheet_name=None)
+
+
+def index_results(paths, index=None, columns=("fix_response", "explanation_response")):
+    """
+    Adds every response of the given experiment CSVs / workbooks to an LSH
+    index (a new one by default) under the key (file name, sheet, column,
+    row), writing or updating each file's signature side-file on the way.
+    """
+    index = index or LSHIndex()
+    for path in paths:
+        name = os.path.basename(path)
+        for sheet_name, sheet in _result_frames(path).items():
+            keys, texts = [], []
+            for column in columns:
+                if column not in sheet:
+                    continue
+                for row, text in sheet[column].items():
+                    if isinstance(text, str):
+                        keys.append((name, sheet_name, column, row))
+                        texts.append(text)
+            if not texts:
+                continue
+            save_file = path if not sheet_name else f"{os.path.splitext(path)[0]}-{sheet_name}.xlsx"
+            for key, signature in zip(keys, write_signatures(texts, save_file, index.num_perm)):
+                index.add(key, signature)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate responses across saved results.")
+    parser.add_argument("paths", nargs="+", help="experiment CSVs or Excel workbooks")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    index = index_results(args.paths)
+    for key_a, key_b, similarity in sorted(index.near_duplicates(args.threshold), key=lambda p: -p[2]):
+        print(f"{similarity:.2f}  {key_a}  {key_b}")
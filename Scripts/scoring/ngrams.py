@@ -0,0 +1,90 @@
+import numpy as np
+import nltk
+from nltk.util import ngrams
+
+from .fast_tokenizer import fast_word_tokenize, fast_tokenize_batch
+
+
+# Tokenizer selection: "nltk" (nltk.word_tokenize, the default) or the
+# opt-in "regex" re-implementation in fast_tokenizer.py
+
+TOKENIZERS = {
+    "nltk": (nltk.word_tokenize, lambda texts: [nltk.word_tokenize(text) for text in texts]),
+    "regex": (fast_word_tokenize, fast_tokenize_batch),
+}
+
+_tokenizer = "nltk"
+
+
+def use_tokenizer(name):
+    """
+    Switches the tokenizer used by tokenize, to_3grams and the token cache.
+    """
+    global _tokenizer
+    if name not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer {name!r}; available: {list(TOKENIZERS)}")
+    _tokenizer = name
+
+
+def current_tokenizer():
+    return _tokenizer
+
+
+def tokenize(text):
+    """
+    Lower-cases and word-tokenizes a response exactly as to_3grams does.
+    """
+    return TOKENIZERS[_tokenizer][0](text.lower())
+
+
+def tokenize_batch(texts):
+    """
+    Lower-cases and word-tokenizes several responses in one call.
+    """
+    return TOKENIZERS[_tokenizer][1]([text.lower() for text in texts])
+
+
+# Function to create 3-grams
+def to_3grams(text):
+    """
+    Converts a text to a list of 3-grams using NLTK.
+    """
+    return list(ngrams(tokenize(text), 3))
+
+
+# Gram Interning
+
+def intern_grams(*sequences, vocab=None):
+    """
+    Maps every n-gram tuple in the given sequences to a small integer ID.
+    Returns one int32 NumPy array per sequence; equal grams get equal IDs,
+    so comparing IDs is the same as comparing the original tuples.
+    """
+    if vocab is None:
+        vocab = {}
+    arrays = []
+    for sequence in sequences:
+        ids = [vocab.setdefault(gram, len(vocab)) for gram in sequence]
+        arrays.append(np.asarray(ids, dtype=np.int32))
+    return arrays
+
+
+def gram_id_arrays(token_id_arrays, order):
+    """
+    Derives n-gram ID arrays of the given order from token ID arrays. Every
+    window of `order` consecutive token IDs is interned jointly across all
+    arrays, so equal n-grams get equal IDs without rebuilding tuples.
+    """
+    windows = []
+    for ids in token_id_arrays:
+        if len(ids) >= order:
+            windows.append(np.lib.stride_tricks.sliding_window_view(ids, order))
+        else:
+            windows.append(np.empty((0, order), dtype=np.int32))
+    stacked = np.concatenate(windows)
+    if len(stacked) == 0:
+        return [np.empty(0, dtype=np.int32) for _ in token_id_arrays]
+    _, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1).astype(np.int32)
+    bounds = np.cumsum([0] + [len(w) for w in windows])
+    return [inverse[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
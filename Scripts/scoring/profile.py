@@ -0,0 +1,142 @@
+"""
+The 3-gram edit distance together with the length statistics needed to
+normalize it.
+
+The experiment scripts divide the distance by the longer response's
+character count. distance_profile() also returns the gram counts, so every
+normalization in NORMALIZATIONS is a division over stored columns. The
+distance comes from int_edit_distance (affix trimming, diagonal pass and
+the selected backend); the length of the optimal alignment needs a full
+DP and is only computed with alignment=True.
+"""
+
+import numpy as np
+
+from .distance import int_edit_distance, trim_common_affixes
+from .distance_cache import default_distance_cache
+from .jit import NUMBA_AVAILABLE, jit_profile
+from .ngrams import intern_grams, to_3grams
+
+
+def alignment_profile(a, b):
+    """
+    Returns (distance, alignment length) for two integer sequences. Of the
+    alignments with minimal distance the one with the fewest insertions and
+    deletions (i.e. the most substitutions) is used, so the alignment length
+    is the smallest possible: (len(a) + len(b) + indels) / 2.
+
+    The DP runs on distance * scale + indels, which orders paths by
+    distance first and indel count second in one pass; rows are vectorized
+    with the running-minimum trick of align._last_row.
+    """
+    original_length = len(a)
+    a, b = trim_common_affixes(np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32))
+    # Trimmed affixes are matches: they only add to the alignment length
+    matched = original_length - len(a)
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return max(n, m), matched + n + m
+    if n > m:
+        a, b, n, m = b, a, m, n
+
+    if NUMBA_AVAILABLE:
+        distance, indels = jit_profile(a, b)
+    else:
+        scale = n + m + 1
+        gap = scale + 1
+        offsets = np.arange(m + 1, dtype=np.int64) * gap
+        row = offsets.copy()
+        for i in range(1, n + 1):
+            candidate = np.empty(m + 1, dtype=np.int64)
+            candidate[0] = i * gap
+            np.minimum(row[1:] + gap, row[:-1] + (b != a[i - 1]) * scale, out=candidate[1:])
+            row = np.minimum.accumulate(candidate - offsets) + offsets
+        distance, indels = divmod(int(row[-1]), scale)
+    return distance, matched + (n + m + indels) // 2
+
+
+def distance_profile(fix_response, explanation_response, fix_grams=None, explanation_grams=None,
+                     alignment=False, raw_distance=None):
+    """
+    Raw 3-gram edit distance and length statistics of a response pair, plus
+    the minimal alignment length with alignment=True. The 3-grams are
+    computed with to_3grams unless given; a raw distance that is already
+    known (e.g. from StreamingDistance) is used as is.
+    """
+    if fix_grams is None:
+        fix_grams = to_3grams(fix_response)
+    if explanation_grams is None:
+        explanation_grams = to_3grams(explanation_response)
+    a, b = intern_grams(fix_grams, explanation_grams)
+    profile = {
+        "3g raw edit distance": int_edit_distance(a, b) if raw_distance is None else int(raw_distance),
+        "fix chars": len(fix_response),
+        "explanation chars": len(explanation_response),
+        "fix 3grams": len(a),
+        "explanation 3grams": len(b),
+    }
+    if alignment:
+        profile["3g alignment length"] = alignment_profile(a, b)[1]
+    return profile
+
+
+# Normalizations of the raw distance: column name -> denominator
+
+NORMALIZATIONS = {
+    "3g edit distance": lambda p: max(p["fix chars"], p["explanation chars"]),
+    "3g edit distance (max grams)": lambda p: max(p["fix 3grams"], p["explanation 3grams"]),
+    "3g edit distance (sum grams)": lambda p: p["fix 3grams"] + p["explanation 3grams"],
+    "3g edit distance (alignment)": lambda p: p["3g alignment length"],
+}
+
+
+def normalized_columns(profile):
+    """
+    Every normalization of the raw distance a profile has the statistics
+    for; a zero denominator gives 0.0.
+    """
+    columns = {}
+    for name, denominator in NORMALIZATIONS.items():
+        if name in ALIGNMENT_COLUMNS and "3g alignment length" not in profile:
+            continue
+        value = denominator(profile)
+        columns[name] = profile["3g raw edit distance"] / value if value else 0.0
+    return columns
+
+
+# Columns that need the alignment pass
+ALIGNMENT_COLUMNS = ["3g edit distance (alignment)", "3g alignment length"]
+
+PROFILE_COLUMNS = [name for name in NORMALIZATIONS if name not in ALIGNMENT_COLUMNS] + [
+    "3g raw edit distance", "fix chars", "explanation chars", "fix 3grams", "explanation 3grams",
+]
+
+# Counts, stored as REAL in the distance cache
+INTEGER_COLUMNS = ("3g raw edit distance", "fix chars", "explanation chars",
+                   "fix 3grams", "explanation 3grams", "3g alignment length")
+
+
+def profile_columns(fix_response, explanation_response, fix_grams=None, explanation_grams=None,
+                    distance_cache=None, use_cache=True, alignment=False, raw_distance=None):
+    """
+    Result columns for a response pair: the normalized variants (starting
+    with the "3g edit distance" of the scripts) followed by the raw distance
+    and length statistics; alignment=True adds ALIGNMENT_COLUMNS. Values
+    are read from and stored in the persistent distance cache (one query
+    each way) unless use_cache is False. raw_distance is passed on to
+    distance_profile.
+    """
+    names = PROFILE_COLUMNS + (ALIGNMENT_COLUMNS if alignment else [])
+    if use_cache:
+        distance_cache = distance_cache or default_distance_cache()
+        cached = distance_cache.get_metrics(fix_response, explanation_response, names)
+        if all(value is not None for value in cached.values()):
+            return {name: int(value) if name in INTEGER_COLUMNS else value
+                    for name, value in cached.items()}
+    profile = distance_profile(fix_response, explanation_response, fix_grams, explanation_grams, alignment,
+                               raw_distance)
+    normalized = normalized_columns(profile)
+    columns = {name: normalized[name] if name in normalized else profile[name] for name in names}
+    if use_cache:
+        distance_cache.put_metrics(fix_response, explanation_response, columns)
+    return columns
@@ -0,0 +1,250 @@
+"""
+Re-scores saved experiment results without calling the LLMs again.
+
+Any DataFrame with fix_response / explanation_response columns (the CSVs
+written by run_*_experiment or the sheets of Data/*.xlsx) can be passed to
+rescore(); the rows are spread over a process pool and the requested metric
+columns are written back into the frame.
+
+Run from the Scripts directory with:
+    python -m scoring.rescore "../Data/Summary gpt-4o-300.xlsx" --metrics "3g edit distance"
+"""
+
+import argparse
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .bpe import bpe_distance_columns
+from .cache import default_cache
+from .chunked import chunked_normalized_distance
+from .profile import PROFILE_COLUMNS, ALIGNMENT_COLUMNS, distance_profile, normalized_columns
+from .distance_cache import default_distance_cache
+from .distance import (gram_distance_columns, select_text_backend, selected_backend, use_selection,
+                       describe_selection)
+from .metadata import write_run_metadata
+from .ngrams import current_tokenizer, use_tokenizer
+
+
+# Metric Registry
+
+# "<n>g edit distance" metrics share one tokenization per row
+GRAM_METRIC_ORDERS = {f"{order}g edit distance": order for order in range(1, 6)}
+
+# Raw distance, length statistics and the other normalizations of the 3-gram
+# distance, all filled from one profile per row (the alignment columns add
+# a full DP)
+PROFILE_METRICS = [name for name in PROFILE_COLUMNS + ALIGNMENT_COLUMNS if name not in GRAM_METRIC_ORDERS]
+
+# Other per-row metrics: name -> function(fix_response, explanation_response)
+METRICS = {}
+
+# BPE token distances use the gpt-4o encoding (o200k_base, also the fallback
+# for models tiktoken does not know)
+BPE_MODEL = "gpt-4o"
+
+
+def _bpe_metric(fix_response, explanation_response, order):
+    columns = bpe_distance_columns(fix_response, explanation_response, BPE_MODEL, (order,))
+    return columns[f"bpe {order}g edit distance"]
+
+
+for _order in (1, 3):
+    METRICS[f"bpe {_order}g edit distance"] = functools.partial(_bpe_metric, order=_order)
+
+# Opt-in paragraph-chunked approximation for very long responses
+METRICS["3g chunked edit distance"] = chunked_normalized_distance
+
+DEFAULT_METRICS = ("3g edit distance",)
+
+
+def available_metrics():
+    return list(GRAM_METRIC_ORDERS) + PROFILE_METRICS + list(METRICS)
+
+
+def score_pair(fix_response, explanation_response, metrics=DEFAULT_METRICS):
+    """
+    Computes the named metrics for one response pair and returns them as a
+    dict of column name -> value.
+    """
+    values = {}
+    orders = [GRAM_METRIC_ORDERS[name] for name in metrics if name in GRAM_METRIC_ORDERS]
+    if orders:
+        values.update(gram_distance_columns(fix_response, explanation_response, orders))
+    profile_names = [name for name in metrics if name in PROFILE_METRICS]
+    if profile_names:
+        profile = distance_profile(fix_response, explanation_response,
+                                   default_cache.grams(fix_response), default_cache.grams(explanation_response),
+                                   alignment=any(name in ALIGNMENT_COLUMNS for name in profile_names))
+        columns = {**normalized_columns(profile), **profile}
+        values.update({name: columns[name] for name in profile_names})
+    for name in metrics:
+        if name in METRICS:
+            values[name] = METRICS[name](fix_response, explanation_response)
+    return values
+
+
+def _score_chunk(chunk, metrics, selection=None, tokenizer=None):
+    # Spawned workers start with the default tokenizer and backend, so the
+    # ones of the rescore call are passed along; in-process the previous
+    # settings are restored afterwards
+    previous_selection, previous_tokenizer = selected_backend(), current_tokenizer()
+    use_selection(selection or describe_selection())
+    if tokenizer is not None:
+        use_tokenizer(tokenizer)
+    try:
+        tokenized = any(name in GRAM_METRIC_ORDERS or name in PROFILE_METRICS for name in metrics)
+        # Rows are primed in blocks that fit the token cache, so no text is
+        # evicted before its row is scored
+        block = max(1, default_cache.maxsize // 2)
+        scored = []
+        for start in range(0, len(chunk), block):
+            rows = chunk[start:start + block]
+            if tokenized:
+                default_cache.prime(text for _, fix, explanation in rows for text in (fix, explanation))
+            scored.extend((index, score_pair(fix, explanation, metrics)) for index, fix, explanation in rows)
+        return scored
+    finally:
+        use_selection(previous_selection)
+        use_tokenizer(previous_tokenizer)
+
+
+# Chunking
+
+def balanced_chunks(rows, n_chunks):
+    """
+    Splits (index, fix_response, explanation_response) rows into n_chunks
+    chunks of similar total cost. The DP cost of a row grows with the
+    product of the two response lengths, so rows are assigned longest-first
+    to the currently cheapest chunk.
+    """
+    chunks = [[] for _ in range(n_chunks)]
+    loads = [0] * n_chunks
+    for row in sorted(rows, key=lambda r: len(r[1]) * len(r[2]), reverse=True):
+        target = loads.index(min(loads))
+        chunks[target].append(row)
+        loads[target] += len(row[1]) * len(row[2]) + 1
+    return [chunk for chunk in chunks if chunk]
+
+
+# Entry Points
+
+def rescore(df, metrics=DEFAULT_METRICS, workers=None, chunks_per_worker=4,
+            fix_column="fix_response", explanation_column="explanation_response",
+            distance_cache=None, use_cache=True):
+    """
+    Scores every row of df that has both responses and writes one column per
+    metric back into df; other rows (e.g. the summary lines under the data
+    in the Data workbooks) keep their existing values. Rows are distributed
+    over `workers` processes (default: all CPUs) in cost-balanced chunks,
+    all using the distance backend that was fastest on a sample of the rows.
+    That selection only applies to this call and is recorded, with the
+    tokenizer, in df.attrs["scoring"].
+
+    Unless use_cache is False, values are first looked up in the persistent
+    distance cache (default: default_distance_cache()) and only rows with a
+    missing metric are scored; their values are stored back. Returns df.
+    """
+    unknown = [name for name in metrics if name not in available_metrics()]
+    if unknown:
+        raise ValueError(f"Unknown metrics {unknown}; available: {available_metrics()}")
+
+    rows = [(index, str(fix), str(explanation))
+            for index, fix, explanation in zip(df.index, df[fix_column], df[explanation_column])
+            if isinstance(fix, str) and isinstance(explanation, str)]
+    workers = workers or os.cpu_count() or 1
+
+    # Rows whose metrics are all cached skip scoring
+    cached = []
+    if use_cache and rows:
+        distance_cache = distance_cache or default_distance_cache()
+        pairs = [(fix, explanation) for _, fix, explanation in rows]
+        found = {name: distance_cache.get_many(pairs, name) for name in metrics}
+        pending = []
+        for position, row in enumerate(rows):
+            values = {name: found[name][position] for name in metrics}
+            if any(value is None for value in values.values()):
+                pending.append(row)
+            else:
+                cached.append((row[0], values))
+        rows = pending
+
+    # Pick the fastest distance backend on a sample of this batch; the
+    # selection only applies to this call
+    selection = describe_selection()
+    if rows and any(name in GRAM_METRIC_ORDERS or name in PROFILE_METRICS for name in metrics):
+        selection = select_text_backend([(fix, explanation) for _, fix, explanation in rows], apply=False)
+    tokenizer = current_tokenizer()
+    df.attrs["scoring"] = {**selection, "tokenizer": tokenizer, "scored_rows": len(rows)}
+
+    if not rows:
+        scored = []
+    elif workers == 1 or len(rows) < 2:
+        scored = _score_chunk(rows, metrics, selection, tokenizer)
+    else:
+        chunks = balanced_chunks(rows, workers * chunks_per_worker)
+        scored = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(_score_chunk, chunks, [metrics] * len(chunks),
+                                   [selection] * len(chunks), [tokenizer] * len(chunks)):
+                scored.extend(result)
+
+    if use_cache and scored:
+        texts = {index: (fix, explanation) for index, fix, explanation in rows}
+        for name in metrics:
+            distance_cache.put_many([(*texts[index], values[name]) for index, values in scored], name)
+
+    values = pd.DataFrame.from_dict(dict(cached + scored), orient="index")
+    if values.empty:
+        return df
+    for column in values.columns:
+        if column not in df:
+            df[column] = float("nan")
+        df.loc[values.index, column] = values[column]
+    return df
+
+
+def rescore_workbook(path, out_path=None, metrics=DEFAULT_METRICS, workers=None, use_cache=True):
+    """
+    Re-scores every sheet of an Excel workbook that has fix_response and
+    explanation_response columns and writes the workbook to out_path
+    (default: "<name>-rescored.xlsx" next to the original).
+    """
+    sheets = pd.read_excel(path, sheet_name=None)
+    scoring = {}
+    for name, sheet in sheets.items():
+        if "fix_response" in sheet and "explanation_response" in sheet:
+            rescore(sheet, metrics, workers, use_cache=use_cache)
+            scoring[name] = sheet.attrs["scoring"]
+    if out_path is None:
+        root, ext = os.path.splitext(path)
+        out_path = f"{root}-rescored{ext}"
+    with pd.ExcelWriter(out_path) as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+    write_run_metadata(out_path, source=path, metrics=list(metrics), distance_backend=scoring)
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score saved experiment results.")
+    parser.add_argument("paths", nargs="+", help="experiment CSVs or Excel workbooks")
+    parser.add_argument("--metrics", nargs="+", default=list(DEFAULT_METRICS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true", help="ignore the persistent distance cache")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if path.endswith(".csv"):
+            df = rescore(pd.read_csv(path), args.metrics, args.workers, use_cache=not args.no_cache)
+            root, _ = os.path.splitext(path)
+            out_path = f"{root}-rescored.csv"
+            df.to_csv(out_path, index=False)
+            write_run_metadata(out_path, source=path, metrics=args.metrics,
+                               distance_backend=df.attrs["scoring"])
+        else:
+            out_path = rescore_workbook(path, metrics=args.metrics, workers=args.workers,
+                                        use_cache=not args.no_cache)
+        print(f"Re-scored {path} -> {out_path}")
@@ -0,0 +1,125 @@
+"""
+Incremental 3-gram edit distance for an explanation response that is still
+being streamed.
+
+The fix response is known before the second request is sent, so its 3-grams
+are fixed. StreamingDistance keeps the last DP column against them and
+extends it by one column per new explanation 3-gram as text arrives; when
+the stream closes, only the last sentence is left to score. The run_*
+functions stream their explanation turn into one (STREAM_EXPLANATION) and
+pass its distance on to profile_columns.
+"""
+
+import re
+
+import numpy as np
+from nltk.util import ngrams
+
+from .align import next_row
+from .ngrams import tokenize, to_3grams
+
+
+# Text is tokenized up to the last sentence or paragraph boundary seen so
+# far; the words after it may still change as more text arrives.
+_BOUNDARY = re.compile(r"[.?!][\"')\]]*\s+(?=\S)|\n\s*\n(?=\S)")
+
+# Every this many explanation grams the DP column is kept, so that a
+# re-tokenization at close() only rolls back to the nearest checkpoint.
+CHECKPOINT_EVERY = 64
+
+
+class StreamingDistance:
+    """
+    Levenshtein distance between the 3-grams of fix_response and of a text
+    fed in chunks with feed(). close() returns exactly
+    edit_distance(to_3grams(fix_response), to_3grams(text)).
+
+    Tokens are committed per sentence. If the full text tokenizes
+    differently from the committed prefix (a sentence boundary that Punkt
+    decides otherwise once the next sentence is known), close() rolls back
+    to the last matching checkpoint and rescores from there.
+    """
+
+    def __init__(self, fix_response):
+        self.vocab = {}
+        self.fix_grams = self._ids(to_3grams(fix_response))
+        self.offsets = np.arange(len(self.fix_grams) + 1, dtype=np.int64)
+        self.text = ""
+        self.committed = 0  # characters of text already tokenized
+        self.tokens = []
+        self.grams = 0  # explanation grams scored so far
+        self.column = self.offsets.copy()
+        self.checkpoints = [(0, self.column)]
+
+    def _ids(self, grams):
+        return np.asarray([self.vocab.setdefault(gram, len(self.vocab)) for gram in grams],
+                          dtype=np.int32)
+
+    def _extend(self, tokens):
+        """
+        Appends tokens and scores the 3-grams they complete.
+        """
+        self.tokens.extend(tokens)
+        new_grams = list(ngrams(self.tokens[self.grams:], 3))
+        for gram_id in self._ids(new_grams):
+            self.grams += 1
+            self.column = next_row(self.column, self.fix_grams, gram_id, self.grams, self.offsets)
+            if self.grams % CHECKPOINT_EVERY == 0:
+                self.checkpoints.append((self.grams, self.column))
+
+    def _rollback(self, n_tokens):
+        """
+        Drops all but the first n_tokens committed tokens.
+        """
+        keep = max(0, n_tokens - 2)
+        while self.checkpoints[-1][0] > keep:
+            self.checkpoints.pop()
+        self.grams, self.column = self.checkpoints[-1]
+        self.tokens = self.tokens[:n_tokens]
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of streamed text and scores every sentence it completes.
+        """
+        self.text += chunk
+        boundary = None
+        for boundary in _BOUNDARY.finditer(self.text, self.committed):
+            pass
+        if boundary is not None:
+            self._extend(tokenize(self.text[self.committed:boundary.end()]))
+            self.committed = boundary.end()
+
+    def distance(self):
+        """
+        Distance between the fix grams and the explanation grams committed
+        so far.
+        """
+        return int(self.column[-1])
+
+    def close(self):
+        """
+        Scores the rest of the text and returns the final distance.
+        """
+        tokens = tokenize(self.text)
+        common = 0
+        for committed, token in zip(self.tokens, tokens):
+            if committed != token:
+                break
+            common += 1
+        if common < len(self.tokens):
+            self._rollback(common)
+        self._extend(tokens[len(self.tokens):])
+        self.committed = len(self.text)
+        return self.distance()
+
+
+def score_stream(fix_response, chunks):
+    """
+    Consumes an iterable of text chunks (e.g. the deltas of a streamed
+    completion) and returns the full explanation text together with its
+    3-gram edit distance to fix_response.
+    """
+    scorer = StreamingDistance(fix_response)
+    for chunk in chunks:
+        scorer.feed(chunk)
+    return scorer.text, scorer.close()